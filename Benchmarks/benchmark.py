@@ -0,0 +1,285 @@
+# Example usage:
+# python ./benchmark.py
+# python ./benchmark.py -b forest -r 1000 10000 100000 -nt 20 -o results.json
+# python ./benchmark.py -b cbr -nc 100 1000 10000 -ni 200 2000
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for source_dir in ['Common', os.path.join('PW1', 'Source'), os.path.join('PW2', 'Source'),
+                   os.path.join('PW3', 'Source')]:
+    sys.path.append(os.path.join(base_dir, source_dir))
+import csvloader
+
+parser = argparse.ArgumentParser('benchmark')
+parser.add_argument('-b', '--benchmarks',
+                    help='Benchmarks that are run: load (csv loading), rules (rule induction and prediction), forest '
+                         '(single tree, bagging and random forest) and cbr (cocktail retrieval). Default: all',
+                    nargs='+', choices=['load', 'rules', 'forest', 'cbr'], default=['load', 'rules', 'forest', 'cbr'])
+parser.add_argument('-r', '--rows',
+                    help='Numbers of rows of the synthetic categorical datasets. Default: 1000 10000',
+                    nargs='+', type=int, default=[1000, 10000])
+parser.add_argument('-f', '--features',
+                    help='Numbers of feature columns of the synthetic categorical datasets. Default: 10',
+                    nargs='+', type=int, default=[10])
+parser.add_argument('-card', '--cardinality',
+                    help='Numbers of distinct values per feature of the synthetic categorical datasets. Default: 4',
+                    nargs='+', type=int, default=[4])
+parser.add_argument('-ncl', '--num_classes',
+                    help='Number of classes of the synthetic categorical datasets. Default: 2',
+                    type=int, default=2)
+parser.add_argument('-t', '--test_percentage',
+                    help='Percentage of the synthetic datasets used for testing the predictions. Default: 0.1',
+                    type=float, default=0.1)
+parser.add_argument('-nt', '--num_trees',
+                    help='Number of trees of the bagging and random forest benchmarks. Default: 10',
+                    type=int, default=10)
+parser.add_argument('-fss', '--feature_subset_size',
+                    help='Feature subset size of the random forest benchmark. Default: 3',
+                    type=int, default=3)
+parser.add_argument('-j', '--jobs',
+                    help='Number of processes that build the trees of the bagging and random forest benchmarks. '
+                         'Default: 1',
+                    type=int, default=1)
+parser.add_argument('-nc', '--num_cocktails',
+                    help='Numbers of cocktails of the synthetic case bases. Default: 100 1000',
+                    nargs='+', type=int, default=[100, 1000])
+parser.add_argument('-ni', '--num_ingredients',
+                    help='Numbers of distinct ingredients of the synthetic case bases. Default: 200',
+                    nargs='+', type=int, default=[200])
+parser.add_argument('-q', '--num_queries',
+                    help='Number of retrieval queries of the cbr benchmark. Default: 20',
+                    type=int, default=20)
+parser.add_argument('-s', '--seed',
+                    help='Seed for the synthetic data. Default: 42',
+                    type=int, default=42)
+parser.add_argument('-o', '--output',
+                    help='.json file to which the results are written. Default: standard output',
+                    type=str)
+
+
+# Synthetic categorical dataset in encoded form in the style of the UCI datasets. The class (column 0) is a random
+# function of the first three features, so there are no instances with identical features and different classes.
+def generate_categorical(num_rows, num_features, cardinality, num_classes, seed):
+    rng = np.random.RandomState(seed)
+    features = rng.randint(0, cardinality, (num_rows, num_features))
+    num_informative = min(3, num_features)
+    class_table = rng.randint(0, num_classes, cardinality ** num_informative)
+    classes = class_table[features[:, :num_informative].dot(cardinality ** np.arange(num_informative))]
+    codes = np.column_stack([classes, features]).astype(csvloader.code_dtype(max(cardinality, num_classes)))
+    header = ['class'] + ['feature-' + str(i) for i in range(num_features)]
+    values = [np.array(['class-' + str(i) for i in range(num_classes)], dtype=object)] + \
+             [np.array(['v' + str(i) for i in range(cardinality)], dtype=object)] * num_features
+    return header, codes, values
+
+
+# Synthetic case base: ingredients are spread over the categories of categories.xml and every cocktail gets a few
+# random ingredients. The cocktails are added to a CaseBase like the case base of main.py. Also returns random
+# queries (desired ingredients, undesired ingredients).
+def generate_case_base(num_cocktails, num_ingredients, num_queries, seed):
+    import casebase
+    from cocktail import Cocktail
+    rng = random.Random(seed)
+    categories = ['alcoholic', 'nonalcoholic', 'fruit', 'special']
+    ingredient_categories, alcohol_contents = {}, {}
+    for i in range(num_ingredients):
+        name = 'ingredient ' + str(i)
+        ingredient_categories[name] = categories[i % len(categories)]
+        if ingredient_categories[name] == 'alcoholic':
+            alcohol_contents[name] = str(rng.randint(5, 60))
+    names = sorted(ingredient_categories)
+    cocktails = []
+    for i in range(num_cocktails):
+        ingredients = [(name, str(rng.randint(1, 20)), 'cl') for name in rng.sample(names, rng.randint(3, 7))]
+        cocktails.append(Cocktail('cocktail ' + str(i), ingredients, True))
+    case_base = casebase.CaseBase(ingredient_categories)
+    case_base.extend(cocktails)
+    queries = []
+    for i in range(num_queries):
+        query = rng.sample(names, 3)
+        queries.append((set(query[:2]), set(query[2:])))
+    return case_base, queries, ingredient_categories, alcohol_contents
+
+
+def split(codes, test_percentage):
+    num_test_rows = int(round(test_percentage * codes.shape[0]))
+    return codes[num_test_rows:], codes[:num_test_rows]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def phase(name, wall_time, num_items, unit, **extra):
+    result = {'phase': name, 'wall_time_s': wall_time, 'items': num_items, 'unit': unit,
+              'throughput': num_items / wall_time if wall_time > 0 else None}
+    result.update(extra)
+    return result
+
+
+def benchmark_load(params):
+    header, codes, values = generate_categorical(params['rows'], params['features'], params['cardinality'],
+                                                 params['num_classes'], params['seed'])
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'dataset.csv')
+        pd.DataFrame({name: values[i][codes[:, i]] for i, name in enumerate(header)}).to_csv(file_name, index=False)
+        loaded, wall_time = timed(csvloader.load_csv, file_name)
+    return [phase('load', wall_time, codes.shape[0], 'rows')]
+
+
+def benchmark_rules(params):
+    import decisionlist
+    import induction
+    header, codes, values = generate_categorical(params['rows'], params['features'], params['cardinality'],
+                                                 params['num_classes'], params['seed'])
+    training, test = split(codes, params['test_percentage'])
+    feature_indices = list(range(1, codes.shape[1]))
+    state = induction.CoveringState(training, 0)
+    rules, wall_time = timed(lambda: list(induction.induce_rules(state, feature_indices)))
+    results = [phase('train', wall_time, training.shape[0], 'rows', num_rules=len(rules))]
+    decision_list = decisionlist.DecisionList(rules, codes.shape[1])
+    (predictions, rule_used, rule_classified_correctly), wall_time = timed(decision_list.predict, test, test[:, 0])
+    results.append(phase('predict', wall_time, test.shape[0], 'rows',
+                         accuracy=float(rule_classified_correctly.sum()) / max(1, test.shape[0])))
+    return results
+
+
+def benchmark_forest(params):
+    import randomforest
+    from forestmodel import ForestModel
+    header, codes, values = generate_categorical(params['rows'], params['features'], params['cardinality'],
+                                                 params['num_classes'], params['seed'])
+    training, test = split(codes, params['test_percentage'])
+    feature_indices = list(range(1, codes.shape[1]))
+    attribute_values = [None] + [list(range(params['cardinality']))] * params['features']
+    tree_builder = randomforest.TreeBuilder(training, 0, attribute_values)
+    results = []
+
+    tree, wall_time = timed(tree_builder.build_tree, np.arange(training.shape[0]), feature_indices, sys.maxsize)
+    results.append(phase('id3_train', wall_time, training.shape[0], 'rows'))
+    predictions, wall_time = timed(lambda: ForestModel.from_trees([tree], tree_builder.num_values,
+                                                                   tree_builder.num_classes).predict(test))
+    results.append(phase('id3_predict', wall_time, test.shape[0], 'rows',
+                         accuracy=float(np.mean(predictions == test[:, 0]))))
+
+    for name, feature_subset_size in [('bagging', sys.maxsize), ('forest', params['feature_subset_size'])]:
+        forest = randomforest.Forest(tree_builder, feature_indices, feature_subset_size, params['seed'])
+        num_trees, wall_time = timed(forest.grow, params['num_trees'], params['jobs'])
+        trees = forest.trees
+        results.append(phase(name + '_train', wall_time, training.shape[0] * params['num_trees'], 'tree_rows'))
+        predictions, wall_time = timed(lambda: ForestModel.from_trees(trees, tree_builder.num_values,
+                                                                       tree_builder.num_classes).predict(test))
+        results.append(phase(name + '_predict', wall_time, test.shape[0], 'rows',
+                             accuracy=float(np.mean(predictions == test[:, 0]))))
+    return results
+
+
+def benchmark_cbr(params):
+    import caseindex
+    import editdistance
+    import main as cbr
+    import querycache
+    cocktails, queries, ingredient_categories, alcohol_contents = generate_case_base(
+        params['num_cocktails'], params['num_ingredients'], params['num_queries'], params['seed'])
+    scorer = editdistance.EditDistanceScorer(ingredient_categories)
+
+    def retrieve_all(*args):
+        return [(sim, cocktail.case_id) for sim, cocktail in
+                [cbr.find_most_similar(cocktails, desired_ingredients, undesired_ingredients, scorer, *args)
+                 for desired_ingredients, undesired_ingredients in queries]]
+
+    full_scan, wall_time = timed(retrieve_all)
+    results = [phase('retrieval_full_scan', wall_time, len(queries), 'queries')]
+    case_index = caseindex.CaseIndex(ingredient_categories)
+    _, wall_time = timed(case_index.update, cocktails)
+    results.append(phase('index_build', wall_time, len(cocktails), 'cocktails'))
+    indexed, wall_time = timed(retrieve_all, case_index)
+    results.append(phase('retrieval_indexed', wall_time, len(queries), 'queries'))
+    # Every query is asked twice, the second time it is answered from the cache
+    cache = querycache.QueryCache(case_index, scorer)
+    cached, wall_time = timed(lambda: retrieve_all(case_index, cache) + retrieve_all(case_index, cache))
+    results.append(phase('retrieval_cached', wall_time, 2 * len(queries), 'queries', hits=cache.hits,
+                         misses=cache.misses))
+    if not full_scan == indexed == cached[:len(queries)] == cached[len(queries):]:
+        raise RuntimeError('The retrieval paths found different cocktails.')
+    return results
+
+
+benchmark_functions = {'load': benchmark_load, 'rules': benchmark_rules, 'forest': benchmark_forest,
+                       'cbr': benchmark_cbr}
+
+
+# Runs in a fresh process, so the peak memory belongs to this benchmark alone. The process is not daemonic, so the
+# benchmark may start worker processes of its own.
+def run_benchmark(name, params, queue):
+    try:
+        results = benchmark_functions[name](params)
+    except BaseException:
+        queue.put(None)
+        raise
+    peak_rss_mb = csvloader.peak_memory_mb()
+    for result in results:
+        result.update({'benchmark': name, 'params': params, 'peak_rss_mb': peak_rss_mb})
+    queue.put(results)
+
+
+def get_metadata():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=base_dir,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'revision': revision, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main():
+    args = parser.parse_args()
+    dataset_params = [{'rows': rows, 'features': features, 'cardinality': cardinality, 'num_classes': args.num_classes,
+                       'test_percentage': args.test_percentage, 'num_trees': args.num_trees,
+                       'feature_subset_size': args.feature_subset_size, 'jobs': args.jobs, 'seed': args.seed}
+                      for rows, features, cardinality in itertools.product(args.rows, args.features, args.cardinality)]
+    case_base_params = [{'num_cocktails': num_cocktails, 'num_ingredients': num_ingredients,
+                         'num_queries': args.num_queries, 'seed': args.seed}
+                        for num_cocktails, num_ingredients in itertools.product(args.num_cocktails,
+                                                                                 args.num_ingredients)]
+    cases = [(name, params) for name in args.benchmarks
+             for params in (case_base_params if name == 'cbr' else dataset_params)]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    for name, params in cases:
+        print('Running ' + name + ' ' + str(params), file=sys.stderr)
+        process = context.Process(target=run_benchmark, args=(name, params, queue))
+        process.start()
+        process_results = queue.get()
+        process.join()
+        if process_results is None:
+            exit('benchmark: error: the ' + name + ' benchmark failed.')
+        results += process_results
+
+    output = json.dumps({'metadata': get_metadata(), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import multiprocessing
+import time
+import numpy as np
+import sharedarray
+
+
+# Assign every row to one of num_folds folds in a random order. The folds differ in size by at most one row. The
+# permutation is the same as the one of csvloader.shuffle_split with the same seed.
+def assign_folds(num_rows, num_folds, seed):
+    folds = np.empty(num_rows, dtype=np.int32)
+    folds[np.random.RandomState(seed).permutation(num_rows)] = np.arange(num_rows) % num_folds
+    return folds
+
+
+# Training and test rows of a fold. Only these index arrays are created per fold, the dataset itself is shared by all
+# folds.
+def fold_rows(folds, fold):
+    return np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+
+
+# Run evaluate_fold(dataset, training_rows, test_rows, *fold_args) for every fold. evaluate_fold returns a list of
+# (name, accuracy) pairs, one per evaluated predictor, and must be a module level function. With more than one job the
+# folds are evaluated concurrently by a pool of processes that attach to the dataset in shared memory. Returns
+# (accuracies, seconds) per fold in the order of the folds.
+def run_folds(evaluate_fold, dataset, folds, num_folds, fold_args=(), jobs=1):
+    if jobs <= 1 or num_folds <= 1:
+        _init_worker(None, None, evaluate_fold, fold_args, dataset, folds)
+        return [_run_fold_in_worker(fold) for fold in range(num_folds)]
+    shared_dataset = sharedarray.SharedArray.copy_of(dataset)
+    shared_folds = sharedarray.SharedArray.copy_of(folds)
+    try:
+        with multiprocessing.Pool(min(jobs, num_folds), _init_worker,
+                                  (shared_dataset.descriptor(), shared_folds.descriptor(), evaluate_fold,
+                                   fold_args)) as pool:
+            return pool.map(_run_fold_in_worker, range(num_folds))
+    finally:
+        shared_dataset.close()
+        shared_folds.close()
+
+
+# Print the accuracy and time of every fold and their mean and standard deviation for every predictor
+def print_cross_validation(results, wall_time):
+    names = [name for name, accuracy in results[0][0]]
+    for fold, (accuracies, seconds) in enumerate(results):
+        print('Fold {}: '.format(fold + 1) + ', '.join('{} {:.2f}%'.format(name, 100 * accuracy)
+                                                      for name, accuracy in accuracies) +
+              ' ({:.2f} s)'.format(seconds))
+    for predictor_index, name in enumerate(names):
+        accuracies = np.array([accuracies[predictor_index][1] for accuracies, seconds in results])
+        print(name + ': Mean accuracy over {} folds: {:.2f}% +- {:.2f}%'.format(
+            len(results), 100 * accuracies.mean(), 100 * accuracies.std()))
+    seconds = np.array([seconds for accuracies, seconds in results])
+    print('Time per fold: {:.2f} s +- {:.2f} s, wall time: {:.2f} s'.format(seconds.mean(), seconds.std(),
+                                                                            wall_time))
+
+
+# State of a worker process: The evaluation function, its extra arguments and the attached shared arrays
+_worker = None
+
+
+def _init_worker(dataset_descriptor, folds_descriptor, evaluate_fold, fold_args, dataset=None, folds=None):
+    global _worker
+    shared_arrays = []
+    if dataset_descriptor is not None:
+        shared_arrays = [sharedarray.SharedArray.attach(dataset_descriptor),
+                         sharedarray.SharedArray.attach(folds_descriptor)]
+        dataset, folds = shared_arrays[0].array, shared_arrays[1].array
+    _worker = evaluate_fold, fold_args, dataset, folds, shared_arrays
+
+
+def _run_fold_in_worker(fold):
+    evaluate_fold, fold_args, dataset, folds, shared_arrays = _worker
+    training_rows, test_rows = fold_rows(folds, fold)
+    start = time.perf_counter()
+    accuracies = evaluate_fold(dataset, training_rows, test_rows, *fold_args)
+    return accuracies, time.perf_counter() - start
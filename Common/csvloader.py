@@ -0,0 +1,89 @@
+import sys
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# Code of values that do not occur in an encoding
+UNKNOWN_CODE = -1
+
+
+# Smallest unsigned integer type that can hold the codes 0 to num_values - 1
+def code_dtype(num_values):
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if num_values <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+# Read a .csv file with categorical columns in chunks and encode the values of every column as integer codes. The
+# dictionaries that translate values into codes are built on the fly, so only the current chunk is ever held as
+# strings. Returns the header, the code matrix in the smallest suitable unsigned type and for each column the array of
+# its values, such that values[column_index][code] gives back the original value.
+def load_csv(file_name, chunk_size=100000):
+    header, value_codes, values, chunks = None, None, None, []
+    for chunk in pd.read_csv(file_name, sep=',', dtype=str, keep_default_na=False, chunksize=chunk_size):
+        if header is None:
+            header = list(chunk.columns)
+            value_codes = [{} for _ in header]
+            values = [[] for _ in header]
+        chunk_codes = []
+        for column_index, name in enumerate(header):
+            # Factorize the chunk and only translate its distinct values with the dictionary of the column
+            local_codes, uniques = pd.factorize(chunk[name].values)
+            translation = np.empty(len(uniques), dtype=np.int64)
+            for local_code, value in enumerate(uniques):
+                code = value_codes[column_index].get(value)
+                if code is None:
+                    code = value_codes[column_index][value] = len(values[column_index])
+                    values[column_index].append(value)
+                translation[local_code] = code
+            chunk_codes.append(translation[local_codes])
+        num_values = max(len(column_values) for column_values in values)
+        chunks.append(np.column_stack(chunk_codes).astype(code_dtype(num_values)))
+
+    num_values = max(len(column_values) for column_values in values)
+    codes = np.concatenate(chunks).astype(code_dtype(num_values), copy=False)
+    return header, codes, [np.array(column_values, dtype=object) for column_values in values]
+
+
+# Encode a matrix of raw values with the values of each column of an existing encoding. Values that do not occur in
+# the encoding get the code UNKNOWN_CODE.
+def encode(instances, values):
+    codes = np.empty(np.shape(instances), dtype=np.int32)
+    for column_index, column_values in enumerate(values):
+        codes[:, column_index] = pd.Categorical(np.asarray(instances[:, column_index]).astype(str),
+                                                categories=np.asarray(column_values)).codes
+    return codes
+
+
+# Translate a code matrix from its own encoding (values) into an existing encoding (target_values) by translating the
+# dictionaries instead of the data. Values that do not occur in the target encoding get the code UNKNOWN_CODE.
+def recode(codes, values, target_values):
+    recoded = np.empty(np.shape(codes), dtype=np.int32)
+    for column_index, (column_values, column_target_values) in enumerate(zip(values, target_values)):
+        translation = pd.Categorical(np.asarray(column_values).astype(str),
+                                     categories=np.asarray(column_target_values)).codes
+        recoded[:, column_index] = translation[codes[:, column_index]]
+    return recoded
+
+
+# Shuffle the row indices with the given seed and split them into training and test rows. The permutation is the
+# same as shuffling the dataset in place with np.random.shuffle after np.random.seed(seed).
+def shuffle_split(num_rows, num_test_rows, seed):
+    np.random.seed(seed)
+    permutation = np.random.permutation(num_rows)
+    return permutation[num_test_rows:], permutation[:num_test_rows]
+
+
+# Peak resident memory of the process in MB or None if it cannot be determined on this platform
+def peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
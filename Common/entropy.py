@@ -0,0 +1,29 @@
+import numpy as np
+
+
+# Entropy kernel for class count vectors. No count is larger than max_count (e.g. the number of training instances),
+# so the terms n * log(n) are read from a precomputed table instead of taking logarithms. With N = sum of the counts c
+# the entropy is -sum(c / N * log(c / N)) = (N * log(N) - sum(c * log(c))) / N.
+class EntropyTable:
+    def __init__(self, max_count):
+        counts = np.arange(max_count + 1)
+        self.n_log_n = counts * np.log(np.maximum(counts, 1))
+
+    # Entropy of the class counts along the last axis (0 for empty count vectors)
+    def entropy(self, class_counts):
+        totals = class_counts.sum(axis=-1)
+        return (self.n_log_n[totals] - self.n_log_n[class_counts].sum(axis=-1)) / np.maximum(totals, 1)
+
+    # Entropy of the subsets of a split weighted according to their size. counts[..., v, c] is the number of instances
+    # with value v and class c. Each subset contributes N_v * entropy_v, which is exactly 0 for pure subsets. The terms
+    # are added up in sorted order, so splits whose tables only differ by the order of the values or classes get
+    # exactly the same entropy and ties can be resolved deterministically.
+    def split_entropy(self, counts):
+        value_totals = counts.sum(axis=-1)
+        weighted_entropies = self.n_log_n[value_totals] - np.sort(self.n_log_n[counts], axis=-1).sum(axis=-1)
+        return np.sort(weighted_entropies, axis=-1).sum(axis=-1) / np.maximum(value_totals.sum(axis=-1), 1)
+
+
+# True for class count vectors (along the last axis) with at most one class, i.e. with entropy 0
+def is_pure(class_counts):
+    return np.count_nonzero(class_counts, axis=-1) <= 1
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import csvloader
+
+
+# Confusion matrix that is accumulated chunk by chunk. counts[t, p] is the number of instances of class t that were
+# predicted as class p, the last column counts the instances without a prediction (code -1, e.g. when no rule
+# applies). Instances whose class does not occur in the encoding cannot be evaluated and are only counted in
+# num_unknown_labels.
+class ConfusionMatrix:
+    def __init__(self, num_classes):
+        self.num_classes = num_classes
+        self.counts = np.zeros((num_classes, num_classes + 1), dtype=np.int64)
+        self.num_unknown_labels = 0
+
+    def add(self, labels, predictions):
+        labels, predictions = np.asarray(labels, dtype=np.int64), np.asarray(predictions, dtype=np.int64)
+        known = labels >= 0
+        self.num_unknown_labels += int(np.count_nonzero(~known))
+        columns = np.where(predictions[known] < 0, self.num_classes, predictions[known])
+        self.counts += np.bincount(labels[known] * (self.num_classes + 1) + columns,
+                                   minlength=self.counts.size).reshape(self.counts.shape)
+
+    def num_instances(self):
+        return int(self.counts.sum())
+
+    def num_correct(self):
+        return int(np.trace(self.counts))
+
+    def accuracy(self):
+        return self.num_correct() / self.num_instances() if self.num_instances() else float('nan')
+
+    # Precision, recall and F1 score of every class. They are nan for classes that were never predicted respectively
+    # do not occur.
+    def precision(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.counts) / self.counts[:, :self.num_classes].sum(axis=0)
+
+    def recall(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.counts) / self.counts.sum(axis=1)
+
+    def f1(self):
+        precision, recall = self.precision(), self.recall()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+
+# Evaluate a predictor on a matrix of encoded instances in chunks. predict maps a chunk of instances to the predicted
+# class codes.
+def evaluate(predict, instances, class_index, num_classes, chunk_size=100000):
+    confusion_matrix = ConfusionMatrix(num_classes)
+    for start in range(0, instances.shape[0], chunk_size):
+        chunk = instances[start:start + chunk_size]
+        confusion_matrix.add(chunk[:, class_index], predict(chunk))
+    return confusion_matrix
+
+
+# Evaluate a predictor on a labelled .csv file that is read in chunks, so the file never has to fit into memory. The
+# instances are encoded with the values of each column of the model.
+def evaluate_csv(predict, file_name, header, values, class_index, chunk_size=100000):
+    confusion_matrix = ConfusionMatrix(len(values[class_index]))
+    for chunk in pd.read_csv(file_name, sep=',', dtype=str, keep_default_na=False, chunksize=chunk_size):
+        missing_names = [str(name) for name in header if name not in chunk.columns]
+        if missing_names:
+            raise ValueError('the columns ' + str(missing_names) + ' of the model are missing.')
+        instances = csvloader.encode(chunk[header].values, values)
+        confusion_matrix.add(instances[:, class_index], predict(instances))
+    return confusion_matrix
+
+
+# Print precision, recall and F1 score of every class and the confusion matrix
+def print_class_metrics(confusion_matrix, class_values, prefix=''):
+    precision, recall, f1 = confusion_matrix.precision(), confusion_matrix.recall(), confusion_matrix.f1()
+    for class_code, class_value in enumerate(class_values):
+        print(prefix + 'Class {}: Precision {:.2f}%, Recall {:.2f}%, F1 {:.2f}% ({} instances)'.format(
+            class_value, 100 * precision[class_code], 100 * recall[class_code], 100 * f1[class_code],
+            confusion_matrix.counts[class_code].sum()))
+    print(prefix + 'Macro average: Precision {:.2f}%, Recall {:.2f}%, F1 {:.2f}%'.format(
+        100 * np.nanmean(precision), 100 * np.nanmean(recall), 100 * np.mean(f1)))
+    names = [str(class_value) for class_value in class_values]
+    print(prefix + 'Confusion matrix (rows: true class, columns: predicted class):')
+    print(pd.DataFrame(confusion_matrix.counts, index=names, columns=names + ['(none)']).to_string())
+    if confusion_matrix.num_unknown_labels:
+        print(prefix + 'Instances with an unknown class: {}'.format(confusion_matrix.num_unknown_labels))
@@ -0,0 +1,35 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# A NumPy array that lives in shared memory. Worker processes attach to it by its descriptor (name, shape, dtype), so
+# large matrices are never pickled and sent to the workers.
+class SharedArray:
+    def __init__(self, shape, dtype, name=None):
+        self.owner = name is None
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    # Create a shared copy of the given array
+    @classmethod
+    def copy_of(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    # Attach to a shared array created by another process
+    @classmethod
+    def attach(cls, descriptor):
+        name, shape, dtype = descriptor
+        return cls(shape, dtype, name)
+
+    def descriptor(self):
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    # The creating process also frees the shared memory
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
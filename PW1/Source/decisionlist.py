@@ -0,0 +1,86 @@
+import os
+import numpy as np
+
+
+# The rules derived by the induction compiled into a batch predictor. Rule i is satisfied by an instance if it has the
+# value conditions[i, j] for every feature j where masks[i, j] is set. As in a decision list the first satisfied rule
+# assigns the class.
+class DecisionList:
+    def __init__(self, rules, num_cols):
+        self.conditions = np.zeros((len(rules), num_cols), dtype=np.int32)
+        self.masks = np.zeros((len(rules), num_cols), dtype=bool)
+        self.classes = np.zeros(len(rules), dtype=np.int32)
+        for rule_index, (feature_combination, attribute_values, assigned_class) in enumerate(rules):
+            self.conditions[rule_index, list(feature_combination)] = attribute_values
+            self.masks[rule_index, list(feature_combination)] = True
+            self.classes[rule_index] = assigned_class
+
+    # Create a decision list from already compiled arrays
+    @classmethod
+    def from_arrays(cls, conditions, masks, classes):
+        decision_list = cls([], 0)
+        decision_list.conditions, decision_list.masks, decision_list.classes = conditions, masks, classes
+        return decision_list
+
+    def num_rules(self):
+        return self.classes.shape[0]
+
+    # The rules as tuples (feature_combination, attribute_values, assigned_class) like they are derived by the
+    # induction
+    def rules(self):
+        return [(tuple(np.flatnonzero(mask)), list(conditions[mask]), assigned_class)
+                for conditions, mask, assigned_class in zip(self.conditions, self.masks, self.classes)]
+
+    # Save the decision list together with everything needed to classify raw data: the column header, the index of
+    # the class column and the values of each column (value i of a column is encoded as i). The model is a directory
+    # of .npy files, so it can be loaded with memory mapping.
+    def save(self, path, header, values, class_index):
+        os.makedirs(path, exist_ok=True)
+        value_strings = [str(value) for column_values in values for value in column_values]
+        value_offsets = np.cumsum([0] + [len(column_values) for column_values in values])
+        arrays = {'conditions': self.conditions, 'masks': self.masks, 'classes': self.classes,
+                  'header': np.array(header, dtype=str), 'values': np.array(value_strings, dtype=str),
+                  'value_offsets': value_offsets, 'class_index': np.array([class_index])}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+    # Load a model saved with save. Returns the decision list, the header, the values of each column and the index of
+    # the class column.
+    @classmethod
+    def load(cls, path):
+        arrays = {}
+        for name in ['conditions', 'masks', 'classes', 'header', 'values', 'value_offsets', 'class_index']:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        offsets = arrays['value_offsets']
+        values = [arrays['values'][offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return (cls.from_arrays(arrays['conditions'], arrays['masks'], arrays['classes']), list(arrays['header']),
+                values, int(arrays['class_index'][0]))
+
+    # Classify a matrix of encoded instances. Instances that satisfy no rule get the prediction -1.
+    # If labels are given also the number of instances each rule was used for and how many of them it classified
+    # correctly are returned.
+    def predict(self, instances, labels=None, chunk_size=None):
+        num_instances = instances.shape[0]
+        predictions = np.full(num_instances, -1, dtype=np.int32)
+        rule_used = np.zeros(self.num_rules(), dtype=np.int64)
+        rule_classified_correctly = np.zeros(self.num_rules(), dtype=np.int64)
+        if not self.num_rules():
+            return (predictions, rule_used, rule_classified_correctly) if labels is not None else predictions
+        if chunk_size is None:
+            # Limit the size of the instances x rules x features intermediate to about 16M elements
+            chunk_size = max(1, 2 ** 24 // self.conditions.size)
+
+        for start in range(0, num_instances, chunk_size):
+            chunk = instances[start:start + chunk_size]
+            satisfied = ((chunk[:, None, :] == self.conditions[None, :, :]) | ~self.masks[None, :, :]).all(axis=2)
+            # argmax returns the first maximum, i.e. the first satisfied rule
+            first_rule = satisfied.argmax(axis=1)
+            matched = satisfied[np.arange(chunk.shape[0]), first_rule]
+            predictions[start:start + chunk.shape[0]][matched] = self.classes[first_rule[matched]]
+            if labels is not None:
+                correct = matched & (predictions[start:start + chunk.shape[0]] == labels[start:start + chunk_size])
+                rule_used += np.bincount(first_rule[matched], minlength=self.num_rules())
+                rule_classified_correctly += np.bincount(first_rule[correct], minlength=self.num_rules())
+
+        return (predictions, rule_used, rule_classified_correctly) if labels is not None else predictions
+
@@ -0,0 +1,237 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+import entropy
+import sharedarray
+
+# Combinations of one size are only distributed to the worker processes if there are at least this many
+MIN_PARALLEL_COMBINATIONS = 64
+
+
+# Bookkeeping of the sequential covering. The encoded training matrix is never copied or modified, instead the
+# alive mask and the shrinking array alive_indices track which training instances are still unclassified. For every
+# accepted rule the indices of the training instances it removed are kept in removed_rows, so metrics can be reported
+# without checking the rules against the training set again.
+class CoveringState:
+    def __init__(self, training, class_index):
+        self.training = training.view()
+        self.training.flags.writeable = False
+        self.class_index = class_index
+        self.classes = self.training[:, class_index]
+        self.num_values = [int(x) + 1 for x in self.training.max(axis=0, initial=0)]
+        self.alive = np.ones(training.shape[0], dtype=bool)
+        self.alive_indices = np.arange(training.shape[0])
+        self.removed_rows = []
+
+    def num_unclassified(self):
+        return self.alive_indices.shape[0]
+
+    # The instance for which the next rule is derived
+    def seed(self):
+        return self.alive_indices[0]
+
+    # Mark the given training instances as covered by a new rule
+    def cover(self, rows):
+        self.alive[rows] = False
+        self.alive_indices = self.alive_indices[self.alive[self.alive_indices]]
+        self.removed_rows.append(rows)
+
+
+# Index of the value combinations of a feature combination. Every distinct tuple of encoded values gets a slot,
+# row_slots maps each training instance to the slot of its values and class_counts holds the class histogram of the
+# unclassified instances in each slot. Checking whether a combination is pure for a seed instance is then just a
+# lookup of the histogram of the seed's slot.
+class CombinationIndex:
+    def __init__(self, state, feature_combination):
+        # Pack the values of an instance into a single integer key (mixed radix). If the keys would overflow they are
+        # compressed to dense slot numbers first.
+        keys = np.zeros(state.training.shape[0], dtype=np.int64)
+        key_range = 1
+        for feature_index in feature_combination:
+            num_values = state.num_values[feature_index]
+            if key_range * num_values >= 2 ** 62:
+                slots, keys = np.unique(keys, return_inverse=True)
+                key_range = len(slots)
+            keys = keys * num_values + state.training[:, feature_index]
+            key_range *= num_values
+        slots, row_slots = np.unique(keys, return_inverse=True)
+        self.row_slots = row_slots.astype(np.int32)
+        self.class_counts = np.zeros((len(slots), state.num_values[state.class_index]), dtype=np.int32)
+        np.add.at(self.class_counts, (self.row_slots[state.alive_indices], state.classes[state.alive_indices]), 1)
+        self.nbytes = self.row_slots.nbytes + self.class_counts.nbytes
+
+    # Tells if all unclassified instances with the same values as the seed are in the same class (the seed itself is
+    # unclassified, so this is its class)
+    def is_pure(self, state, seed):
+        return entropy.is_pure(self.class_counts[self.row_slots[seed]])
+
+    # Indices of the unclassified instances with the same values as the seed
+    def find_covered(self, state, seed):
+        return state.alive_indices[self.row_slots[state.alive_indices] == self.row_slots[seed]]
+
+    # Update the class histograms after the given instances were covered
+    def remove(self, state, rows):
+        np.subtract.at(self.class_counts, (self.row_slots[rows], state.classes[rows]), 1)
+
+
+# The indexes of the feature combinations are built lazily and cached across seed instances. To bound the memory
+# the least recently used indexes are evicted once their total size exceeds max_bytes.
+class CombinationIndexCache:
+    def __init__(self, state, max_bytes):
+        self.state = state
+        self.max_bytes = max_bytes
+        self.indexes = collections.OrderedDict()
+        self.nbytes = 0
+
+    def get(self, feature_combination):
+        index = self.indexes.get(feature_combination)
+        if index is not None:
+            self.indexes.move_to_end(feature_combination)
+            return index
+        index = CombinationIndex(self.state, feature_combination)
+        if index.nbytes <= self.max_bytes:
+            self.indexes[feature_combination] = index
+            self.nbytes += index.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.indexes.popitem(last=False)[1].nbytes
+        return index
+
+    def remove(self, rows):
+        for index in self.indexes.values():
+            index.remove(self.state, rows)
+
+
+# Search for the first feature combination (smallest size first, then in the order of itertools.combinations) for
+# which all unclassified instances that agree with the seed instance on these features are in the same class.
+class CombinationSearch:
+    def __init__(self, state, feature_indices, max_index_bytes):
+        self.state = state
+        self.feature_indices = feature_indices
+        self.index_cache = CombinationIndexCache(state, max_index_bytes)
+
+    # Position of the first of the given feature combinations that is pure for the seed instance or None
+    def first_pure(self, seed, feature_combinations):
+        for position, feature_combination in enumerate(feature_combinations):
+            if self.index_cache.get(feature_combination).is_pure(self.state, seed):
+                return position
+        return None
+
+    def first_pure_of_size(self, seed, num_combinations):
+        feature_combinations = list(itertools.combinations(self.feature_indices, num_combinations))
+        position = self.first_pure(seed, feature_combinations)
+        return None if position is None else feature_combinations[position]
+
+    # Returns the first pure combination for the current seed and the indices of the training instances that
+    # satisfy it.
+    def find_pure_combination(self):
+        seed = self.state.seed()
+        for num_combinations in range(1, len(self.feature_indices) + 1):
+            feature_combination = self.first_pure_of_size(seed, num_combinations)
+            if feature_combination is not None:
+                return feature_combination, self.index_cache.get(feature_combination).find_covered(self.state, seed)
+        raise ValueError('There are instances with identical features but different classes, so no pure rule '
+                         'exists.')
+
+    # Must be called after the given instances were covered by a new rule
+    def remove(self, rows):
+        self.index_cache.remove(rows)
+
+    def close(self):
+        pass
+
+
+# The same search, but the combinations of one size are split into chunks that are checked by a pool of worker
+# processes. The training matrix and the alive mask are placed in shared memory, each worker keeps its own
+# CombinationSearch and catches up with the covered instances by comparing against the shared alive mask. The result
+# of the first chunk with a pure combination is used, so the rules are the same as with the serial search.
+class ParallelCombinationSearch(CombinationSearch):
+    def __init__(self, state, feature_indices, max_index_bytes, jobs):
+        super().__init__(state, feature_indices, max_index_bytes)
+        self.jobs = jobs
+        self.training = sharedarray.SharedArray.copy_of(state.training)
+        self.alive = sharedarray.SharedArray.copy_of(state.alive)
+        # Number of the current search, so the workers can skip chunks of a search that was already finished
+        self.generation = sharedarray.SharedArray((1,), np.int64)
+        self.generation.array[0] = 0
+        self.pool = multiprocessing.Pool(jobs, _init_worker, (self.training.descriptor(), self.alive.descriptor(),
+                                                              self.generation.descriptor(), state.class_index,
+                                                              max_index_bytes))
+
+    def first_pure_of_size(self, seed, num_combinations):
+        feature_combinations = list(itertools.combinations(self.feature_indices, num_combinations))
+        if len(feature_combinations) < MIN_PARALLEL_COMBINATIONS:
+            return super().first_pure_of_size(seed, num_combinations)
+        self.generation.array[0] += 1
+        chunk_size = -(-len(feature_combinations) // (4 * self.jobs))
+        chunks = [feature_combinations[start:start + chunk_size]
+                  for start in range(0, len(feature_combinations), chunk_size)]
+        tasks = [(self.generation.array[0], seed, chunk) for chunk in chunks]
+        # imap returns the results in the order of the chunks
+        for chunk, position in zip(chunks, self.pool.imap(_first_pure_in_worker, tasks)):
+            if position is not None:
+                return chunk[position]
+        return None
+
+    def remove(self, rows):
+        super().remove(rows)
+        self.alive.array[rows] = False
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        for shared in (self.training, self.alive, self.generation):
+            shared.close()
+
+
+# State of a worker process of the ParallelCombinationSearch
+_worker = None
+
+
+def _init_worker(training_descriptor, alive_descriptor, generation_descriptor, class_index, max_index_bytes):
+    global _worker
+    training = sharedarray.SharedArray.attach(training_descriptor)
+    alive = sharedarray.SharedArray.attach(alive_descriptor)
+    generation = sharedarray.SharedArray.attach(generation_descriptor)
+    search = CombinationSearch(CoveringState(training.array, class_index), None, max_index_bytes)
+    _worker = search, training, alive, generation
+
+
+def _first_pure_in_worker(task):
+    task_generation, seed, feature_combinations = task
+    search, training, alive, generation = _worker
+    if task_generation != generation.array[0]:
+        return None
+    # Catch up with the instances that were covered since the last task
+    removed = search.state.alive_indices[~alive.array[search.state.alive_indices]]
+    if removed.shape[0]:
+        search.state.cover(removed)
+        search.remove(removed)
+    return search.first_pure(seed, feature_combinations)
+
+
+# Sequential covering: repeatedly derive a rule for the first unclassified instance and mark all instances it covers
+# as classified in the given CoveringState. Yields the rules (feature_combination, attribute_values, assigned_class)
+# in encoded form, the training instances removed by a rule can be looked up in state.removed_rows.
+# max_index_bytes bounds the memory of the cached combination indexes (per process), with jobs > 1 the combinations
+# are checked by that many worker processes.
+def induce_rules(state, feature_indices, max_index_bytes=256 * 1024 ** 2, jobs=1):
+    if jobs > 1:
+        search = ParallelCombinationSearch(state, feature_indices, max_index_bytes, jobs)
+    else:
+        search = CombinationSearch(state, feature_indices, max_index_bytes)
+    try:
+        while state.num_unclassified():
+            seed = state.training[state.seed()]
+            feature_combination, satisfy_indices = search.find_pure_combination()
+            state.cover(satisfy_indices)
+            search.remove(satisfy_indices)
+            yield (feature_combination,
+                   [seed[feature_index] for feature_index in feature_combination],
+                   seed[state.class_index])
+    finally:
+        search.close()
@@ -2,11 +2,23 @@
 # python ./rules.py ../Data/house-votes-84.data -t 0.9 -c first -pm
 # python ./rules.py ../Data/agaricus-lepiota.data -t 0.9 -c first -pm
 # python ./rules.py ../Data/car.data -t 0.9 -c last -pm
+# python ./rules.py ../Data/car.data -t 0.1 -c last -sm car_model
+# python ./rules.py ../Data/car.data -c last -cv 10 -j 4
+# python ./rules.py predict car_model ../Data/car.data -o predictions.csv
 
 import numpy as np
 import pandas as pd
-import itertools
 import argparse
+import os
+import sys
+import time
+import decisionlist
+import induction
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+import crossvalidation
+import csvloader
+import evaluation
 
 def percentage_type(x):
     x = float(x)
@@ -14,7 +26,10 @@ def percentage_type(x):
         raise argparse.ArgumentTypeError("Value must be between 0.0 and 1.0")
     return x
 
-parser = argparse.ArgumentParser('rules')
+parser = argparse.ArgumentParser('rules',
+                                 epilog='To classify new data with a model saved with --save_model run: rules predict '
+                                        'model file_name (see rules predict -h). A dataset file that is named predict '
+                                        'has to be given as ./predict.')
 parser.add_argument('file_name',
                     help='.csv file that both contain training and test data.', type=str)
 parser.add_argument('-c', '--class_index',
@@ -30,110 +45,201 @@ parser.add_argument('-s', '--seed',
 parser.add_argument('-pm', '--print_metrics',
                     help='If set detailed metrics (precision, coverage) of each generated rule is printed.',
                     action='store_true')
-args = parser.parse_args()
-
-dataset = pd.read_csv(args.file_name, sep=',')
-header = list(dataset)
-dataset = dataset.values
-num_rows, num_cols = np.shape(dataset)
-num_test_rows = int(round(args.test_percentage * num_rows))
-num_training_rows = num_rows - num_test_rows
-if args.class_index == 'first':
-    args.class_index = 0
-elif args.class_index == 'last':
-    args.class_index = num_cols - 1
-elif args.class_index.is_digit() and not 0 <= int(args.class_index) < num_cols:
-    parser.print_usage()
-    exit('rules: error: argument -c/--class_index: Class index is out of bounds.')
-class_index = args.class_index
-feature_indices = list(range(class_index)) + list(range(class_index + 1, num_cols))
-np.random.seed(args.seed)
-np.random.shuffle(dataset)
-training = dataset[num_test_rows:]
-test = dataset[:num_test_rows]
-print('Number of training instances: ' + str(num_training_rows))
-print('Number of test instances: ' + str(num_test_rows))
-
-
-def print_rule(feature_combination, attribute_values, assigned_class):
+parser.add_argument('-cm', '--class_metrics',
+                    help='If set precision, recall and F1 score of each class and the confusion matrix on the test '
+                         'dataset are printed.',
+                    action='store_true')
+parser.add_argument('-mim', '--max_index_memory',
+                    help='Maximum memory in MB used to cache the value combination indexes of feature combinations.'
+                         ' Default: 256',
+                    type=int, default=256)
+parser.add_argument('-j', '--jobs',
+                    help='Number of processes that search for feature combinations in parallel. Default: 1',
+                    type=int, default=1)
+parser.add_argument('-sm', '--save_model',
+                    help='Directory to which the derived rules are saved, so they can be used by the predict command.',
+                    type=str)
+parser.add_argument('-lm', '--load_model',
+                    help='Directory of a model saved with --save_model. Its rules are evaluated on the test dataset '
+                         'instead of deriving new rules.',
+                    type=str)
+parser.add_argument('-cv', '--cv',
+                    help='If given, K-fold cross-validation with this number of folds is performed instead of a single '
+                         'split into training and test data. With --jobs the folds are evaluated in parallel.',
+                    type=int)
+parser.add_argument('-rm', '--report_memory',
+                    help='If set the peak memory usage after loading the dataset and at the end is printed.',
+                    action='store_true')
+
+# Classify new data with a saved model: python ./rules.py predict model file_name
+predict_parser = argparse.ArgumentParser('rules predict')
+predict_parser.add_argument('model',
+                            help='Directory of a model saved with --save_model.', type=str)
+predict_parser.add_argument('file_name',
+                            help='.csv file with the instances to classify. It must contain all feature columns of '
+                                 'the model, the class column is optional.', type=str)
+predict_parser.add_argument('-o', '--output',
+                            help='.csv file to which the predictions are written. Default: standard output',
+                            type=str)
+predict_parser.add_argument('-cs', '--chunk_size',
+                            help='Number of rows that are read and classified at once. Default: 100000',
+                            type=int, default=100000)
+predict_parser.add_argument('-e', '--evaluate',
+                            help='If set the predictions are not written but compared with the class column of the '
+                                 'file, and the accuracy, the metrics of each class and the confusion matrix are '
+                                 'printed.',
+                            action='store_true')
+
+
+def print_rule(rule, header, values, class_index):
+    feature_combination, attribute_values, assigned_class = rule
     out = 'IF '
     for feature_index, attribute_value in zip(feature_combination, attribute_values):
-        out += header[feature_index] + ' = ' + str(attribute_value) + ' AND '
-    print(out[:-4] + 'THEN ' + str(assigned_class))
-
-# Data structure for a rule. Tuple (feature_combination, attribute_values, assigned_class)
-# where feature_combination: list of indices of the involved features
-# attribute_values = values of these features
-# assigned_class = class that is assigned to instance if it satisfies the condition
-rules = []
-unclassified = training # in the beginning the whole training set is unclassified
-
-# Continue as long as there are unclassified examples.
-while unclassified.shape[0]:
-    for num_combinations in range(1, num_cols):
-        all_in_same_class = None # just declare it outside the below loop so we can propagate the break
-        for feature_combination in itertools.combinations(feature_indices, num_combinations):
-            satisfy_indices = [0]
-            all_in_same_class = True
-            for index in range(1, unclassified.shape[0]):
-                conditions_satisfied = True
-                for feature_index in feature_combination:
-                    if unclassified[0][feature_index] != unclassified[index][feature_index]:
-                        conditions_satisfied = False
-                        break
-                if conditions_satisfied:
-                    if unclassified[0][class_index] != unclassified[index][class_index]:
-                        all_in_same_class = False
-                        break
-                    satisfy_indices.append(index)
-
-            # Create a new rule only if all instances that satisfy the condition
-            # are in the same class
-            if all_in_same_class:
-                new_rule = (feature_combination,
-                            [unclassified[0][feature_index] for feature_index in feature_combination],
-                            unclassified[0][class_index])
-                print_rule(*new_rule)
+        out += header[feature_index] + ' = ' + str(values[feature_index][attribute_value]) + ' AND '
+    print(out[:-4] + 'THEN ' + str(values[class_index][assigned_class]))
+
+
+# Derive the rules from the training rows of a cross-validation fold and return their accuracy on its test rows
+def evaluate_fold(dataset, training_rows, test_rows, class_index, num_classes, feature_indices, max_index_bytes):
+    rules = list(induction.induce_rules(induction.CoveringState(dataset[training_rows], class_index), feature_indices,
+                                        max_index_bytes))
+    test = dataset[test_rows]
+    confusion_matrix = evaluation.ConfusionMatrix(num_classes)
+    confusion_matrix.add(test[:, class_index], decisionlist.DecisionList(rules, dataset.shape[1]).predict(test))
+    return [('Rules', confusion_matrix.accuracy())]
+
+
+# Stream the instances of a .csv file through a saved model and write the predicted classes. Instances that are not
+# covered by any rule get an empty prediction.
+def predict(args):
+    decision_list, header, values, class_index = decisionlist.DecisionList.load(args.model)
+    if args.evaluate:
+        try:
+            confusion_matrix = evaluation.evaluate_csv(decision_list.predict, args.file_name, header, values,
+                                                       class_index, args.chunk_size)
+        except ValueError as error:
+            exit('rules: error: ' + str(error))
+        print('Accuracy: {:.2f}%'.format(100 * confusion_matrix.accuracy()))
+        evaluation.print_class_metrics(confusion_matrix, values[class_index])
+        return
+    feature_names = [name for column_index, name in enumerate(header) if column_index != class_index]
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    for chunk_index, chunk in enumerate(pd.read_csv(args.file_name, sep=',', dtype=str, keep_default_na=False,
+                                                    chunksize=args.chunk_size)):
+        missing_names = [name for name in feature_names if name not in chunk.columns]
+        if missing_names:
+            exit('rules: error: the columns ' + str(missing_names) + ' of the model are missing.')
+        instances = csvloader.encode(chunk.reindex(columns=header, fill_value='').values, values)
+        predictions = decision_list.predict(instances)
+        predicted_classes = np.where(predictions >= 0, np.asarray(values[class_index])[predictions], '')
+        pd.DataFrame({header[class_index]: predicted_classes}).to_csv(output, header=chunk_index == 0, index=False)
+    if args.output:
+        output.close()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'predict':
+        predict(predict_parser.parse_args(sys.argv[2:]))
+        return
+    args = parser.parse_args()
+
+    # All columns are encoded as small integer codes while reading, so the rule induction only has to compare small
+    # integers.
+    header, dataset, values = csvloader.load_csv(args.file_name)
+    if args.report_memory:
+        print('Peak memory after loading the dataset: {:.1f} MB'.format(csvloader.peak_memory_mb()))
+    num_rows, num_cols = np.shape(dataset)
+    num_test_rows = int(round(args.test_percentage * num_rows))
+    num_training_rows = num_rows - num_test_rows
+    if args.class_index == 'first':
+        args.class_index = 0
+    elif args.class_index == 'last':
+        args.class_index = num_cols - 1
+    elif args.class_index.is_digit() and not 0 <= int(args.class_index) < num_cols:
+        parser.print_usage()
+        exit('rules: error: argument -c/--class_index: Class index is out of bounds.')
+    class_index = args.class_index
+    feature_indices = list(range(class_index)) + list(range(class_index + 1, num_cols))
+    if args.cv is not None:
+        if not 2 <= args.cv <= num_rows:
+            parser.print_usage()
+            exit('rules: error: argument -cv/--cv: The number of folds must be between 2 and the number of instances.')
+        if args.load_model or args.save_model:
+            exit('rules: error: argument -cv/--cv: not allowed with argument -lm/--load_model or -sm/--save_model.')
+        start = time.perf_counter()
+        folds = crossvalidation.assign_folds(num_rows, args.cv, args.seed)
+        fold_args = class_index, len(values[class_index]), feature_indices, args.max_index_memory * 1024 ** 2
+        try:
+            results = crossvalidation.run_folds(evaluate_fold, dataset, folds, args.cv, fold_args, args.jobs)
+        except ValueError as error:
+            exit('rules: error: ' + str(error))
+        crossvalidation.print_cross_validation(results, time.perf_counter() - start)
+        if args.report_memory:
+            print('Peak memory: {:.1f} MB'.format(csvloader.peak_memory_mb()))
+        return
+    if args.load_model:
+        decision_list, model_header, model_values, class_index = decisionlist.DecisionList.load(args.load_model)
+        if model_header != header:
+            exit('rules: error: the columns of the dataset do not match the columns of the model.')
+        dataset, values = csvloader.recode(dataset, values, model_values), model_values
+    training_rows, test_rows = csvloader.shuffle_split(num_rows, num_test_rows, args.seed)
+    training = dataset[training_rows]
+    test = dataset[test_rows]
+    print('Number of training instances: ' + str(num_training_rows))
+    print('Number of test instances: ' + str(num_test_rows))
+
+    if args.load_model:
+        rules = decision_list.rules()
+        print('Number of loaded rules: ' + str(len(rules)))
+    else:
+        # Data structure for a rule. Tuple (feature_combination, attribute_values, assigned_class)
+        # where feature_combination: list of indices of the involved features
+        # attribute_values = values of these features
+        # assigned_class = class that is assigned to instance if it satisfies the condition
+        # Values and classes are stored as integer codes, see values for the translation.
+        rules = []
+        covering_state = induction.CoveringState(training, class_index)
+        try:
+            for new_rule in induction.induce_rules(covering_state, feature_indices,
+                                                   args.max_index_memory * 1024 ** 2, args.jobs):
+                print_rule(new_rule, header, values, class_index)
                 if args.print_metrics:
                     # Printing the precision during training makes no sense since with this algorithm the precision
                     # of each rule is 1.0
+                    coverage = len(covering_state.removed_rows[len(rules)])
                     print('Coverage: {} instances {:.2f}% of all instances'.
-                          format(len(satisfy_indices), 100 * len(satisfy_indices) / num_training_rows))
+                          format(coverage, 100 * coverage / num_training_rows))
                 rules.append(new_rule)
-                # Delete all the examples that are covered by the new rule
-                unclassified = np.delete(unclassified, satisfy_indices, 0)
-                break
-        if all_in_same_class:
-            break
-
-print('Number of derived rules: ' + str(len(rules)))
-
-
-# Finally use our rules to predict class labels on the test dataset
-num_classified_correctly = 0
-rule_classified_correctly_arr = [0] * len(rules)
-rule_used_arr = [0] * len(rules)
-for instance in test:
-    for rule_index, rule in enumerate(rules):
-        condition_satisfied = True
-        for (x, y) in zip(rule[0], range(len(rule[0]))):
-            if instance[x] != rule[1][y]:
-                condition_satisfied = False
-                break
-        if condition_satisfied:
-            rule_used_arr[rule_index] += 1
-            # Compare the predicted label to the actual label
-            if instance[class_index] == rule[2]:
-                num_classified_correctly += 1
-                rule_classified_correctly_arr[rule_index] += 1
-            break
-
-if args.print_metrics:
-    print('-' * 80 + '\n\nDetailed metrics for using the rules on the test dataset:')
-    for rule, rule_used, rule_classified_correctly in zip(rules, rule_used_arr, rule_classified_correctly_arr):
-        print_rule(*rule)
-        print('Coverage: {} instances {:.2f}% of all instances'.
-              format(rule_used, 100 * rule_used / num_test_rows))
-        print('Precision: {:.2f}%'.format(100 * rule_classified_correctly / rule_used))
-
-print('Accuracy on test dataset: {:.2f}%'.format(100 * num_classified_correctly / num_test_rows))
+        except ValueError as error:
+            exit('rules: error: ' + str(error))
+
+        print('Number of derived rules: ' + str(len(rules)))
+        decision_list = decisionlist.DecisionList(rules, num_cols)
+        if args.save_model:
+            decision_list.save(args.save_model, header, values, class_index)
+
+    # Finally use our rules to predict class labels on the test dataset. The rules are compiled into a decision list
+    # that classifies the whole test set at once and counts how often each rule was used and was correct.
+    predictions, rule_used_arr, rule_classified_correctly_arr = decision_list.predict(test, test[:, class_index])
+    confusion_matrix = evaluation.ConfusionMatrix(len(values[class_index]))
+    confusion_matrix.add(test[:, class_index], predictions)
+
+    if args.print_metrics:
+        print('-' * 80 + '\n\nDetailed metrics for using the rules on the test dataset:')
+        for rule, rule_used, rule_classified_correctly in zip(rules, rule_used_arr, rule_classified_correctly_arr):
+            print_rule(rule, header, values, class_index)
+            print('Coverage: {} instances {:.2f}% of all instances'.
+                  format(rule_used, 100 * rule_used / num_test_rows))
+            # The precision of a rule that was never used on the test dataset is undefined
+            if rule_used:
+                print('Precision: {:.2f}%'.format(100 * rule_classified_correctly / rule_used))
+
+    print('Accuracy on test dataset: {:.2f}%'.format(100 * confusion_matrix.accuracy()))
+    if args.class_metrics:
+        evaluation.print_class_metrics(confusion_matrix, values[class_index])
+    if args.report_memory:
+        print('Peak memory: {:.1f} MB'.format(csvloader.peak_memory_mb()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import collections
+import os
+import numpy as np
+
+
+# Decision trees compiled into flat node tables for batch prediction. The nodes of all trees are numbered
+# consecutively and roots[t] is the root node of tree t. An inner node splits on attribute features[node] and its
+# child for the encoded value v is children[node, v + 1]. Column 0 is reserved for the unknown code -1 (see
+# csvloader.encode) and like all values without a subtree it refers back to the node itself, so instances with such a
+# value stop there. A leaf has the feature -1. node_classes[node] is the class of a leaf and the most common class of
+# the training instances of an inner node. A single tree is a forest with one tree.
+class ForestModel:
+    def __init__(self, features, children, node_classes, roots, num_classes):
+        self.features = features
+        self.children = children
+        self.node_classes = node_classes
+        self.roots = roots
+        self.num_classes = num_classes
+
+    # Compile the nested dict trees built by the TreeBuilder. num_values is the number of distinct codes of the
+    # attribute with the most values.
+    @classmethod
+    def from_trees(cls, trees, num_values, num_classes):
+        features, children, node_classes, roots = [], [], [], []
+        for tree in trees:
+            roots.append(len(features))
+            # Number the nodes in breadth first order, so the nodes of one level are next to each other
+            queue = collections.deque([(tree, len(features))])
+            features.append(-1)
+            children.append([len(children)] * (num_values + 1))
+            node_classes.append(-1)
+            while queue:
+                node, node_index = queue.popleft()
+                if not isinstance(node, dict):
+                    node_classes[node_index] = node
+                    continue
+                features[node_index] = node['attribute_index']
+                node_classes[node_index] = node['most_common_class']
+                for attribute_value, subtree in node['subtrees'].items():
+                    children[node_index][attribute_value + 1] = len(features)
+                    queue.append((subtree, len(features)))
+                    features.append(-1)
+                    children.append([len(children)] * (num_values + 1))
+                    node_classes.append(-1)
+        return cls(np.array(features, dtype=np.int32),
+                   np.array(children, dtype=np.int32).reshape(-1, num_values + 1),
+                   np.array(node_classes, dtype=np.int32), np.array(roots, dtype=np.int32), num_classes)
+
+    # Save the model together with everything needed to classify raw data: the column header, the index of the class
+    # column, the values of each column (value i of a column is encoded as i) and the attribute values the trees were
+    # built with. The model is a directory of .npy files, so it can be loaded with memory mapping and several processes
+    # that classify with the same model share one copy of it in the page cache.
+    def save(self, path, header, values, class_index, attribute_values):
+        os.makedirs(path, exist_ok=True)
+        value_strings = [str(value) for column_values in values for value in column_values]
+        value_offsets = np.cumsum([0] + [len(column_values) for column_values in values])
+        # The class column has no attribute values (None), it is saved as an empty list
+        attribute_values = [column_values or [] for column_values in attribute_values]
+        attribute_value_offsets = np.cumsum([0] + [len(column_values) for column_values in attribute_values])
+        arrays = {'features': self.features, 'children': self.children, 'node_classes': self.node_classes,
+                  'roots': self.roots, 'num_classes': np.array([self.num_classes]),
+                  'header': np.array(header, dtype=str), 'values': np.array(value_strings, dtype=str),
+                  'value_offsets': value_offsets, 'class_index': np.array([class_index]),
+                  'attribute_values': np.array([x for column_values in attribute_values for x in column_values],
+                                               dtype=np.int64),
+                  'attribute_value_offsets': attribute_value_offsets}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+    # Load a model saved with save. Returns the model, the header, the values of each column, the index of the class
+    # column and the attribute values.
+    @classmethod
+    def load(cls, path):
+        arrays = {}
+        for name in ['features', 'children', 'node_classes', 'roots', 'num_classes', 'header', 'values',
+                     'value_offsets', 'class_index', 'attribute_values', 'attribute_value_offsets']:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        offsets = arrays['value_offsets']
+        values = [arrays['values'][offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        class_index = int(arrays['class_index'][0])
+        offsets = arrays['attribute_value_offsets']
+        attribute_values = [None if i == class_index else [int(x) for x in
+                                                           arrays['attribute_values'][offsets[i]:offsets[i + 1]]]
+                            for i in range(len(offsets) - 1)]
+        model = cls(arrays['features'], arrays['children'], arrays['node_classes'], arrays['roots'],
+                    int(arrays['num_classes'][0]))
+        return model, list(arrays['header']), values, class_index, attribute_values
+
+    def num_trees(self):
+        return self.roots.shape[0]
+
+    def num_nodes(self):
+        return self.features.shape[0]
+
+    # Nodes at which a matrix of encoded instances ends up in every tree (one column per tree). This is a leaf unless
+    # the instance has a value for which the node has no subtree. The instances advance through a tree level by level,
+    # in each step only the instances that have not stopped yet take part. The trees are processed one after another,
+    # so the nodes of the current tree stay in the cache.
+    def leaves(self, instances):
+        num_instances, num_cols = instances.shape
+        num_columns = self.children.shape[1]
+        # Gathers with precomputed flat indices are faster than indexing the 2d arrays
+        flat_children = self.children.reshape(-1)
+        flat_instances = np.ascontiguousarray(instances).reshape(-1)
+        leaves = np.empty((self.num_trees(), num_instances), dtype=np.int32)
+        for tree_index, root in enumerate(self.roots):
+            nodes = np.full(num_instances, root, dtype=np.intp)
+            active = np.arange(num_instances) if self.features[root] >= 0 else np.arange(0)
+            while active.shape[0]:
+                active_nodes = nodes[active]
+                values = flat_instances[active * num_cols + self.features[active_nodes]]
+                # The column of value v is v + 1, the index is computed in intp so the codes cannot overflow
+                children = flat_children[(active_nodes * num_columns + 1) + values]
+                nodes[active] = children
+                active = active[(self.features[children] >= 0) & (children != active_nodes)]
+            leaves[tree_index] = nodes
+        return leaves.T
+
+    # Classes predicted by every tree for a matrix of encoded instances (one column per tree)
+    def predict_trees(self, instances):
+        return self.node_classes[self.leaves(instances)]
+
+    # Majority vote of the trees for a matrix of encoded instances. Ties are resolved in favor of the class that was
+    # predicted first in the order of the trees. A forest without trees predicts no class (-1) for every instance.
+    def predict(self, instances, chunk_size=None):
+        num_instances, num_trees = instances.shape[0], self.num_trees()
+        if num_trees == 0:
+            return np.full(num_instances, -1, dtype=np.int32)
+        predictions = np.empty(num_instances, dtype=np.int32)
+        if chunk_size is None:
+            # Limit the size of the instances x trees intermediates to about 4M elements
+            chunk_size = max(1, 2 ** 22 // num_trees)
+
+        for start in range(0, num_instances, chunk_size):
+            # One row per tree, so the votes of a tree are a contiguous row
+            tree_predictions = self.predict_trees(instances[start:start + chunk_size]).T
+            num_chunk_instances = tree_predictions.shape[1]
+            instance_indices = np.arange(num_chunk_instances)
+            votes = np.zeros((num_chunk_instances, self.num_classes), dtype=np.int64)
+            # first[i, c] is the first tree that predicted class c for instance i
+            first = np.full((num_chunk_instances, self.num_classes), num_trees)
+            for tree_index in range(num_trees - 1, -1, -1):
+                votes[instance_indices, tree_predictions[tree_index]] += 1
+                first[instance_indices, tree_predictions[tree_index]] = tree_index
+            predictions[start:start + num_chunk_instances] = np.argmax(votes * (num_trees + 1) - first, axis=1)
+        return predictions
+
+    # Permutation importance: the decrease of the accuracy on the labelled instances when the values of one feature
+    # are shuffled, so the feature carries no information about the class anymore. Returns the decrease for every
+    # column (0 for the columns that are not in feature_indices).
+    def permutation_importance(self, instances, labels, feature_indices, seed):
+        importances = np.zeros(instances.shape[1])
+        if not instances.shape[0]:
+            return importances
+        accuracy = np.mean(self.predict(instances) == labels)
+        rng = np.random.default_rng(seed)
+        permuted = np.array(instances)
+        for attribute_index in feature_indices:
+            permuted[:, attribute_index] = instances[rng.permutation(instances.shape[0]), attribute_index]
+            importances[attribute_index] = accuracy - np.mean(self.predict(permuted) == labels)
+            permuted[:, attribute_index] = instances[:, attribute_index]
+        return importances
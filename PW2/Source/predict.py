@@ -0,0 +1,66 @@
+# Example usage:
+# python ./randomforest.py ../Data/car.data -t 0.9 -c last -sm ../Models/car
+# python ./predict.py ../Models/car/forest ../Data/car.data -o predictions.csv
+
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+import csvloader
+import evaluation
+from forestmodel import ForestModel
+
+parser = argparse.ArgumentParser('predict')
+parser.add_argument('model',
+                    help='Directory of a single tree, bagging or random forest model saved with --save_model of '
+                         'randomforest.py.', type=str)
+parser.add_argument('file_name',
+                    help='.csv file with the instances to classify. It must contain all feature columns of the model, '
+                         'the class column is optional.', type=str)
+parser.add_argument('-o', '--output',
+                    help='.csv file to which the predictions are written. Default: standard output',
+                    type=str)
+parser.add_argument('-cs', '--chunk_size',
+                    help='Number of rows that are read and classified at once. Default: 100000',
+                    type=int, default=100000)
+parser.add_argument('-e', '--evaluate',
+                    help='If set the predictions are not written but compared with the class column of the file, and '
+                         'the accuracy, the metrics of each class and the confusion matrix are printed.',
+                    action='store_true')
+
+
+# Stream the instances of a .csv file through a saved model and write the predicted classes. Values that do not
+# occur in the training data are encoded as unknown, the trees then use the most common class of the node that splits
+# on them.
+def main():
+    args = parser.parse_args()
+    model, header, values, class_index, attribute_values = ForestModel.load(args.model)
+    if args.evaluate:
+        try:
+            confusion_matrix = evaluation.evaluate_csv(model.predict, args.file_name, header, values, class_index,
+                                                       args.chunk_size)
+        except ValueError as error:
+            exit('predict: error: ' + str(error))
+        print('Accuracy: {:.2f}%'.format(100 * confusion_matrix.accuracy()))
+        evaluation.print_class_metrics(confusion_matrix, values[class_index])
+        return
+    feature_indices = [column_index for column_index in range(len(header)) if column_index != class_index]
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    for chunk_index, chunk in enumerate(pd.read_csv(args.file_name, sep=',', dtype=str, keep_default_na=False,
+                                                    chunksize=args.chunk_size)):
+        missing_names = [header[column_index] for column_index in feature_indices
+                         if header[column_index] not in chunk.columns]
+        if missing_names:
+            exit('predict: error: the columns ' + str(missing_names) + ' of the model are missing.')
+        instances = csvloader.encode(chunk.reindex(columns=header, fill_value='').values, values)
+        predicted_classes = np.asarray(values[class_index])[model.predict(instances)]
+        pd.DataFrame({header[class_index]: predicted_classes}).to_csv(output, header=chunk_index == 0, index=False)
+    if args.output:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,24 @@
 # python ./randomforest.py ../Data/house-votes-84.data -t 0.9 -c first
 # python ./randomforest.py ../Data/agaricus-lepiota.data -t 0.9 -c first
 # python ./randomforest.py ../Data/car.data -t 0.9 -c last
+# python ./randomforest.py ../Data/car.data -c last -cv 10 -j 4
 
 import numpy as np
-import pandas as pd
 import argparse
-import math
+import collections
+import multiprocessing
+import os
 from random import Random
 import sys
-import operator
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+import crossvalidation
+import csvloader
+import entropy
+import evaluation
+import sharedarray
+from forestmodel import ForestModel
 
 def percentage_type(x):
     x = float(x)
@@ -36,216 +46,573 @@ parser.add_argument('-nt', '--num_trees',
 parser.add_argument('-fss', '--feature_subset_size',
                     help='Number of features that are considered at each split as a candidate. Default: 3',
                     type=int, default=3)
-args = parser.parse_args()
-
-dataset = pd.read_csv(args.file_name, sep=',')
-header = list(dataset)
-dataset = dataset.values
-num_rows, num_cols = np.shape(dataset)
-num_test_rows = int(round(args.test_percentage * num_rows))
-num_training_rows = num_rows - num_test_rows
-if args.class_index == 'first':
-    args.class_index = 0
-elif args.class_index == 'last':
-    args.class_index = num_cols - 1
-elif args.class_index.is_digit() and not 0 <= int(args.class_index) < num_cols:
-    parser.print_usage()
-    exit('randomforest: error: argument -c/--class_index: Class index is out of bounds.')
-class_index = args.class_index
-feature_indices = list(range(class_index)) + list(range(class_index + 1, num_cols))
-np.random.seed(args.seed)
-np.random.shuffle(dataset)
-random = Random(args.seed)
-training = dataset[num_test_rows:]
-test = dataset[:num_test_rows]
-print('Number of training instances: ' + str(num_training_rows))
-print('Number of test instances: ' + str(num_test_rows))
-
-
-def create_attribute_subsets(subset, attribute_index):
-    attribute_subsets = {}
-    for sample in subset:
-        if sample[attribute_index] in attribute_subsets:
-            attribute_subsets[sample[attribute_index]].append(sample)
-        else:
-            attribute_subsets[sample[attribute_index]] = [sample]
-    return attribute_subsets
-
-
-def create_class_counts(subset):
-    class_counts = {}
-    for sample in subset:
-        if sample[class_index] in class_counts:
-            class_counts[sample[class_index]] += 1
-        else:
-            class_counts[sample[class_index]] = 1
-    return class_counts
-
-
-def get_most_common_class(subset):
-    max_class_count, most_common_class = -1, ''
-    class_counts = create_class_counts(subset)
-    for the_class, class_count in class_counts.items():
-        if class_count > max_class_count:
-            max_class_count, most_common_class = class_count, the_class
-    return most_common_class
-
-
-def calculate_entropy(subset):
-    class_counts = create_class_counts(subset)
-    subset_entropy = 0
-    for class_count in class_counts.values():
-        p_x = float(class_count) / len(subset)
-        subset_entropy -= p_x * math.log(p_x)
-    return subset_entropy
-
-
-# Aggregate all the attribute values
-attribute_values = [None] * num_cols
-for attribute_index in feature_indices:
-    attribute_values[attribute_index] = list(set([x[attribute_index] for x in dataset]))
-
-
-def build_tree(subset, unused_attributes, feature_subset_size):
-    # If all elements of subset are in the same class we can make this a leaf node
-    if len(set([x[class_index] for x in subset])) == 1:
-        return subset[0][class_index]
-
-    if len(unused_attributes) == 0:
-        # Get most common class
-        return get_most_common_class(subset)
-
-    # Apply the random forest technique of only considering a subset of features here
-    # but only if we have enough features to begin with.
-    feature_subset = unused_attributes
-    if len(feature_subset) > feature_subset_size:
-        feature_subset = random.sample(feature_subset, feature_subset_size)
-
-    min_index, min_entropy = 0, sys.maxsize
-    for attribute_index in feature_subset:
-        # Create subsets for that given attribute
-        attribute_subsets = create_attribute_subsets(subset, attribute_index)
-
-        # Calculate entropy of the generated subsets and weight them according to their size
-        entropy = 0
-        for attribute_subset in attribute_subsets.values():
-            entropy += float(len(attribute_subset) / len(subset)) * calculate_entropy(attribute_subset)
-
-        # Keep track of the split attribute with minimum entropy
-        if entropy < min_entropy:
-            min_index, min_entropy = attribute_index, entropy
-
-    # Copy list otherwise our passed feature_indices array will be modified.
-    unused_attributes = list(unused_attributes)
-    unused_attributes.remove(min_index)
-
-    # Reconstruct subsets of best attribute and use them to build subtrees recursively
-    # As a measure of feature importance we save the feature importance (information gain) here
-    attribute_subsets = create_attribute_subsets(subset, min_index)
-    tree = {'attribute_index': min_index, 'subtrees': {}, 'information_gain': calculate_entropy(subset) - min_entropy}
-
-    # Make sure to add for all values that exist in the training dataset labels
-    most_common_class = None
-    for attribute_value in attribute_values[min_index]:
-        if attribute_value in attribute_subsets and len(attribute_subsets[attribute_value]):
-            tree['subtrees'][attribute_value] = build_tree(attribute_subsets[attribute_value], unused_attributes,
-                                                           feature_subset_size)
-        else:
-            if not most_common_class:
-                most_common_class = get_most_common_class(subset)
-            tree['subtrees'][attribute_value] = most_common_class
-
-    return tree
-
-
-def classify(example, tree):
-    if isinstance(tree, str):
-        return tree
-    else:
-        return classify(example, tree['subtrees'][example[tree['attribute_index']]])
-
-# Counts predictions of all trees in the forest and selects the one with the highest count
-def majority_vote(example, trees):
-    votes = {}
-    for tree in trees:
-        prediction = classify(example, tree)
-        if prediction in votes:
-            votes[prediction] += 1
-        else:
-            votes[prediction] = 1
-    majority_prediction, max_vote = None, 0
-    for prediction, num_votes in votes.items():
-        if num_votes > max_vote:
-            majority_prediction, max_vote = prediction, num_votes
-    return majority_prediction
-
-
-# Translate attribute indices into human readable columns
-def pretty_tree(tree):
-    if isinstance(tree, str):
-        return tree
+parser.add_argument('-md', '--max_depth',
+                    help='Maximum depth of the trees. Default: no limit',
+                    type=int)
+parser.add_argument('-mss', '--min_samples_split',
+                    help='Minimum number of samples a node needs to be split. Default: 2',
+                    type=int, default=2)
+parser.add_argument('-msl', '--min_samples_leaf',
+                    help='Minimum number of samples of every subtree of a split. Default: 1',
+                    type=int, default=1)
+parser.add_argument('-mn', '--max_nodes',
+                    help='Maximum number of nodes of each tree. Default: no limit',
+                    type=int)
+parser.add_argument('-ts', '--tree_stats',
+                    help='If set the number of nodes and the depth of every tree are printed.',
+                    action='store_true')
+parser.add_argument('-j', '--jobs',
+                    help='Number of processes that build the trees of bagging and the random forest in parallel. The '
+                         'trees do not depend on the number of processes. Default: 1',
+                    type=int, default=1)
+parser.add_argument('-oc', '--oob_curve',
+                    help='If set the out-of-bag accuracy of bagging and the random forest is printed for every number of '
+                         'trees, which helps to choose the number of trees.',
+                    action='store_true')
+parser.add_argument('-es', '--early_stopping',
+                    help='If given, bagging and the random forest stop adding trees (before --num_trees is reached) '
+                         'once the out-of-bag accuracy and the mean out-of-bag vote margin changed by at most this '
+                         'tolerance over the last --early_stopping_window trees, e.g. 0.001.',
+                    type=float)
+parser.add_argument('-esw', '--early_stopping_window',
+                    help='Number of trees over which the out-of-bag estimates must be stable for early stopping. '
+                         'Default: 10',
+                    type=int, default=10)
+parser.add_argument('-sm', '--save_model',
+                    help='Directory to which the single tree, bagging and random forest models are saved (in the '
+                         'subdirectories tree, bagging and forest). They can be used with predict.py.',
+                    type=str)
+parser.add_argument('-fi', '--feature_importance',
+                    help='Feature importance of the random forest that is printed: the average information gain of '
+                         'the splits on a feature (gain), the information gain weighted by the share of samples that '
+                         'reach the splits averaged over the trees (weighted_gain) or the decrease of the accuracy on '
+                         'the test dataset when the values of a feature are shuffled (permutation). Default: gain',
+                    choices=['gain', 'weighted_gain', 'permutation'], default='gain')
+parser.add_argument('-cm', '--class_metrics',
+                    help='If set precision, recall and F1 score of each class and the confusion matrix on the test '
+                         'dataset are printed for the single tree, bagging and the random forest.',
+                    action='store_true')
+parser.add_argument('-cv', '--cv',
+                    help='If given, K-fold cross-validation with this number of folds is performed instead of a single '
+                         'split into training and test data. With --jobs the folds are evaluated in parallel (the '
+                         'trees of a fold are then built by a single process).',
+                    type=int)
+parser.add_argument('-rm', '--report_memory',
+                    help='If set the peak memory usage after loading the dataset and at the end is printed.',
+                    action='store_true')
+
+
+# Contingency tables of the candidate attributes of a node. attribute_codes holds the values of the candidate
+# attributes (one column per attribute) and classes the classes of the samples of the node. counts[a, v, c] is the
+# number of samples with value v of attribute a and class c.
+def create_contingency_tables(attribute_codes, classes, num_values, num_classes):
+    num_samples, num_attributes = attribute_codes.shape
+    keys = ((np.arange(num_attributes) * num_values + attribute_codes) * num_classes + classes[:, None]).ravel()
+    counts = np.bincount(keys, minlength=num_attributes * num_values * num_classes)
+    return counts.reshape(num_attributes, num_values, num_classes)
+
+
+# Position of the first sample with each key (e.g. a class) in a node, or the number of samples if there is none
+def get_first_positions(keys, num_keys):
+    first = np.full(num_keys, len(keys))
+    unique_keys, positions = np.unique(keys, return_index=True)
+    first[unique_keys] = positions
+    return first
+
+
+# Most common class, ties are resolved in favor of the class that appears first
+def get_most_common_class(class_counts, first):
+    order = np.argsort(first, kind='stable')
+    return int(order[np.argmax(class_counts[order])])
+
+
+# Aggregate all the attribute values that occur in the given rows of the encoded dataset. The codes are sorted, so
+# the subtrees are built in the same order (and consume the random numbers in the same order) in every run with the
+# same seed, independent of the hash seed of the strings.
+def get_attribute_values(dataset, feature_indices, rows):
+    attribute_values = [None] * dataset.shape[1]
+    for attribute_index in feature_indices:
+        attribute_values[attribute_index] = [int(code) for code in np.unique(dataset[rows, attribute_index])]
+    return attribute_values
+
+
+# Impurity based feature importance that is accumulated while the trees are built. For every attribute the number of
+# splits on it and the sum of their information gains are kept, and the sum of the gains weighted by the share of the
+# training samples of the tree that reach the node. first_split orders the attributes by their first split. Feature
+# importances of trees built by different processes are merged by adding them up in the order of the trees.
+class FeatureImportance:
+    def __init__(self, num_cols, num_trees=0):
+        self.num_trees = num_trees
+        self.num_splits = np.zeros(num_cols, dtype=np.int64)
+        self.gains = np.zeros(num_cols)
+        self.weighted_gains = np.zeros(num_cols)
+        self.first_split = np.full(num_cols, np.iinfo(np.int64).max)
+
+    def add_split(self, attribute_index, information_gain, weight):
+        if not self.num_splits[attribute_index]:
+            self.first_split[attribute_index] = self.num_splits.sum()
+        self.num_splits[attribute_index] += 1
+        self.gains[attribute_index] += information_gain
+        self.weighted_gains[attribute_index] += weight * information_gain
+
+    def add(self, other):
+        # The splits of the other trees come after the splits of these trees
+        other_first_split = other.first_split.copy()
+        other_first_split[other.num_splits > 0] += self.num_splits.sum()
+        self.first_split = np.where(self.num_splits > 0, self.first_split, other_first_split)
+        self.num_trees += other.num_trees
+        self.num_splits += other.num_splits
+        self.gains += other.gains
+        self.weighted_gains += other.weighted_gains
+
+    # Average information gain of the splits on each attribute
+    def average_gains(self):
+        return self.gains / np.maximum(self.num_splits, 1)
+
+    # Decrease of the entropy per tree that is caused by the splits on each attribute (mean decrease impurity)
+    def mean_weighted_gains(self):
+        return self.weighted_gains / max(self.num_trees, 1)
+
+
+# Builds ID3 decision trees on the encoded training set. Nodes are represented by the indices of their training
+# samples, so the samples are never copied. attribute_values holds all values of each attribute. random is the random
+# number generator used for the feature subsets of the random forest, it is only needed for trees that use them.
+# The size of the trees can be limited: nodes deeper than max_depth, with fewer than min_samples_split samples or
+# whose split would leave a subtree with fewer than min_samples_leaf samples become leaves, and a tree has at most
+# max_nodes nodes (None means no limit). num_nodes and depth describe the last tree that was built.
+class TreeBuilder:
+    def __init__(self, training, class_index, attribute_values, random=None, max_depth=None, min_samples_split=2,
+                 min_samples_leaf=1, max_nodes=None):
+        self.training = training
+        self.classes = training[:, class_index]
+        self.class_index = class_index
+        self.attribute_values = attribute_values
+        self.random = random
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.max_nodes = max_nodes
+        self.num_values = max(len(x) for x in attribute_values if x is not None)
+        self.num_classes = int(self.classes.max(initial=0)) + 1
+        self.importance = FeatureImportance(training.shape[1])
+        # No class count of a node can be larger than the number of training samples
+        self.entropy_table = entropy.EntropyTable(training.shape[0])
+        self.num_nodes, self.depth = 0, 0
+
+    def limits(self):
+        return {'max_depth': self.max_depth, 'min_samples_split': self.min_samples_split,
+                'min_samples_leaf': self.min_samples_leaf, 'max_nodes': self.max_nodes}
+
+    # The nodes are built breadth first from a queue instead of recursively, so the node budget is spent level by
+    # level and deep trees do not hit the recursion limit. Every queue entry holds the dict and key under which the
+    # node is stored, its samples, the attributes that are left, its class counts, the position of the first sample of
+    # each class and its entropy. Except for the root these are derived from the split of the parent.
+    def build_tree(self, rows, unused_attributes, feature_subset_size):
+        classes = self.classes[rows]
+        class_counts = np.bincount(classes, minlength=self.num_classes)
+        root = {}
+        queue = collections.deque([(root, 'tree', rows, unused_attributes, class_counts,
+                                    get_first_positions(classes, self.num_classes),
+                                    self.entropy_table.entropy(class_counts), 0)])
+        self.num_nodes, self.depth = 1, 0
+        while queue:
+            parent, key, rows, unused_attributes, class_counts, class_first, node_entropy, depth = queue.popleft()
+            self.depth = max(self.depth, depth)
+            # If all elements of subset are in the same class we can make this a leaf node
+            if entropy.is_pure(class_counts):
+                parent[key] = int(np.argmax(class_counts))
+                continue
+
+            # Otherwise the node is a leaf with the most common class if it cannot be split
+            most_common_class = get_most_common_class(class_counts, class_first)
+            parent[key] = most_common_class
+            if len(unused_attributes) == 0 or len(rows) < self.min_samples_split or \
+                    (self.max_depth is not None and depth >= self.max_depth):
+                continue
+
+            # Apply the random forest technique of only considering a subset of features here
+            # but only if we have enough features to begin with.
+            feature_subset = unused_attributes
+            if len(feature_subset) > feature_subset_size:
+                feature_subset = self.random.sample(feature_subset, feature_subset_size)
+
+            # Count value x class for all candidate attributes at once and pick the split attribute with minimum
+            # entropy among those that leave enough samples in every subtree
+            classes = self.classes[rows]
+            counts = create_contingency_tables(self.training[np.ix_(rows, feature_subset)], classes, self.num_values,
+                                               self.num_classes)
+            split_entropies = self.entropy_table.split_entropy(counts)
+            if self.min_samples_leaf > 1:
+                value_totals = counts.sum(axis=2)
+                too_small = ((value_totals > 0) & (value_totals < self.min_samples_leaf)).any(axis=1)
+                split_entropies[too_small] = np.inf
+            best = int(np.argmin(split_entropies))
+            min_index, min_entropy = feature_subset[best], split_entropies[best]
+            num_subtrees = len(self.attribute_values[min_index])
+            if np.isinf(min_entropy) or (self.max_nodes is not None and
+                                         self.num_nodes + num_subtrees > self.max_nodes):
+                continue
+            self.num_nodes += num_subtrees
+
+            # Copy list otherwise our passed feature_indices array will be modified.
+            unused_attributes = list(unused_attributes)
+            unused_attributes.remove(min_index)
+
+            # As a measure of feature importance we save the feature importance (information gain) here. The class
+            # distribution of the node and its most common class are kept for values that were not seen in training.
+            tree = {'attribute_index': min_index, 'subtrees': {},
+                    'information_gain': float(node_entropy - min_entropy),
+                    'class_counts': [int(x) for x in class_counts], 'most_common_class': most_common_class}
+            parent[key] = tree
+            self.importance.add_split(min_index, tree['information_gain'], float(len(rows)) / self.training.shape[0])
+
+            # Partition the samples by the values of the best attribute (keeping their order). The subtrees get their
+            # class counts, first positions (only their order matters, so the positions in this node can be used) and
+            # entropies from the contingency table of the split.
+            best_values = self.training[rows, min_index]
+            value_counts = counts[best].sum(axis=1)
+            partition = rows[np.argsort(best_values, kind='stable')]
+            boundaries = np.concatenate([[0], np.cumsum(value_counts)])
+            value_first = get_first_positions(best_values.astype(np.intp) * self.num_classes + classes,
+                                              self.num_values * self.num_classes).reshape(self.num_values,
+                                                                                          self.num_classes)
+            value_entropies = self.entropy_table.entropy(counts[best])
+
+            # Make sure to add for all values that exist in the training dataset labels. The subtrees that are built
+            # later are already added, so the subtrees keep the order of the values.
+            for attribute_value in self.attribute_values[min_index]:
+                if value_counts[attribute_value]:
+                    tree['subtrees'][attribute_value] = None
+                    queue.append((tree['subtrees'], attribute_value,
+                                  partition[boundaries[attribute_value]:boundaries[attribute_value + 1]],
+                                  unused_attributes, counts[best, attribute_value], value_first[attribute_value],
+                                  value_entropies[attribute_value], depth + 1))
+                else:
+                    tree['subtrees'][attribute_value] = most_common_class
+            self.depth = max(self.depth, depth + 1)
+
+        return root['tree']
+
+    # Build tree number tree_index of a forest from a bootstrap sample of the training set. The bootstrap sample is an
+    # array of row indices. Every tree has its own random number generators derived from the seed and its index, so
+    # the tree does not depend on which trees were built before it or by which process. Returns the tree, the
+    # bootstrap sample as a bitset of the training instances (packed with np.packbits), the feature importance of the
+    # tree and its number of nodes and depth.
+    def build_bootstrap_tree(self, seed, tree_index, feature_indices, feature_subset_size):
+        bootstrap_sequence, feature_sequence = np.random.SeedSequence(seed, spawn_key=(tree_index,)).spawn(2)
+        num_training_rows = self.training.shape[0]
+        bootstrap_rows = np.random.default_rng(bootstrap_sequence).integers(0, num_training_rows, num_training_rows)
+        self.random = Random(int(feature_sequence.generate_state(1)[0]))
+        self.importance = FeatureImportance(self.training.shape[1], 1)
+        in_bag = np.zeros(num_training_rows, dtype=bool)
+        in_bag[bootstrap_rows] = True
+        tree = self.build_tree(bootstrap_rows, feature_indices, feature_subset_size)
+        return tree, np.packbits(in_bag), self.importance, (self.num_nodes, self.depth)
+
+    # Build the trees first_tree_index, ..., first_tree_index + num_trees - 1 of a forest from bootstrap samples of
+    # the training set (bagging). With a feature_subset_size smaller than the number of features this is a random
+    # forest. Yields the results of build_bootstrap_tree in the order of the trees as they are finished. With more
+    # than one job the trees are built by a pool of processes that share the training set through shared memory.
+    def grow_forest(self, feature_indices, num_trees, feature_subset_size, seed, jobs=1, first_tree_index=0):
+        tasks = [(seed, tree_index, feature_indices, feature_subset_size)
+                 for tree_index in range(first_tree_index, first_tree_index + num_trees)]
+        if jobs <= 1 or num_trees <= 1:
+            for task in tasks:
+                yield self.build_bootstrap_tree(*task)
+            return
+        shared_training = sharedarray.SharedArray.copy_of(self.training)
+        try:
+            with multiprocessing.Pool(min(jobs, num_trees), _init_worker,
+                                      (shared_training.descriptor(), self.class_index, self.attribute_values,
+                                       self.limits())) as pool:
+                for result in pool.imap(_build_tree_in_worker, tasks):
+                    yield result
+        finally:
+            shared_training.close()
+
+
+# Out-of-bag estimate of the accuracy of a forest that is updated tree by tree. Every training instance is classified
+# by the majority vote of the trees whose bootstrap sample does not contain it (ties are resolved like in
+# ForestModel.predict), instances that are in every bootstrap sample so far are not counted. accuracies[k - 1] is the
+# estimate for the first k trees.
+class OutOfBagEstimate:
+    def __init__(self, training, class_index, num_values, num_classes):
+        self.training = training
+        self.classes = training[:, class_index]
+        self.num_values = num_values
+        self.num_classes = num_classes
+        num_training_rows = training.shape[0]
+        self.votes = np.zeros((num_training_rows, num_classes), dtype=np.int64)
+        # First tree that voted for a class, classes without votes keep a value larger than any tree index
+        self.first = np.full((num_training_rows, num_classes), np.iinfo(np.int32).max, dtype=np.int64)
+        self.voted = np.zeros(num_training_rows, dtype=bool)
+        self.correct = np.zeros(num_training_rows, dtype=bool)
+        # Share of the votes for the true class minus the largest share for another class
+        self.margins = np.zeros(num_training_rows)
+        self.accuracies = []
+        self.mean_margins = []
+
+    def num_trees(self):
+        return len(self.accuracies)
+
+    # Add the votes of the next tree for the instances that are not in its bootstrap bitset
+    def add_tree(self, tree, in_bag):
+        tree_index = self.num_trees()
+        out_of_bag = np.flatnonzero(~np.unpackbits(in_bag, count=self.training.shape[0]).astype(bool))
+        predictions = ForestModel.from_trees([tree], self.num_values, self.num_classes).predict(
+            self.training[out_of_bag])
+        self.votes[out_of_bag, predictions] += 1
+        self.first[out_of_bag, predictions] = np.minimum(self.first[out_of_bag, predictions], tree_index)
+        # Only the majority votes of the instances this tree voted for can have changed
+        scores = self.votes[out_of_bag] * (tree_index + 2) - self.first[out_of_bag]
+        self.correct[out_of_bag] = np.argmax(scores, axis=1) == self.classes[out_of_bag]
+        votes = self.votes[out_of_bag]
+        num_votes = votes.sum(axis=1)
+        instance_indices = np.arange(out_of_bag.shape[0])
+        true_votes = votes[instance_indices, self.classes[out_of_bag]]
+        votes[instance_indices, self.classes[out_of_bag]] = -1
+        self.margins[out_of_bag] = (true_votes - votes.max(axis=1)) / num_votes
+        self.voted[out_of_bag] = True
+        num_voted = np.count_nonzero(self.voted)
+        self.accuracies.append(float(np.count_nonzero(self.correct)) / num_voted if num_voted else float('nan'))
+        self.mean_margins.append(float(self.margins[self.voted].mean()) if num_voted else float('nan'))
+
+    def accuracy(self):
+        return self.accuracies[-1] if self.accuracies else float('nan')
+
+    # True if the accuracy and the mean vote margin changed by at most tolerance over the last window trees
+    def has_converged(self, tolerance, window):
+        if self.num_trees() <= window:
+            return False
+        for curve in (self.accuracies, self.mean_margins):
+            # Written this way, so undefined estimates (nan) never count as converged
+            if not np.ptp(curve[-window - 1:]) <= tolerance:
+                return False
+        return True
+
+
+# A bagging or random forest ensemble that can be grown further (warm start). Tree i is always built with the seed
+# sequence for index i, so growing a forest of k trees by m trees gives the same forest as building k + m trees at
+# once. The out-of-bag estimate is updated as the trees are added.
+class Forest:
+    def __init__(self, tree_builder, feature_indices, feature_subset_size, seed):
+        self.tree_builder = tree_builder
+        self.feature_indices = feature_indices
+        self.feature_subset_size = feature_subset_size
+        self.seed = seed
+        self.trees = []
+        self.in_bags = []
+        self.importance = FeatureImportance(tree_builder.training.shape[1])
+        self.num_nodes = []
+        self.depths = []
+        self.out_of_bag = OutOfBagEstimate(tree_builder.training, tree_builder.class_index, tree_builder.num_values,
+                                           tree_builder.num_classes)
+
+    def num_trees(self):
+        return len(self.trees)
+
+    # Add up to num_trees trees. If a tolerance is given, growing stops early as soon as the out-of-bag accuracy and
+    # mean vote margin have stabilized within the tolerance over the last window trees. Returns the number of trees
+    # that were added.
+    def grow(self, num_trees, jobs=1, tolerance=None, window=10):
+        num_trees_before = self.num_trees()
+        results = self.tree_builder.grow_forest(self.feature_indices, num_trees, self.feature_subset_size, self.seed,
+                                                jobs, num_trees_before)
+        try:
+            for tree, in_bag, importance, (num_nodes, depth) in results:
+                self.trees.append(tree)
+                self.in_bags.append(in_bag)
+                self.importance.add(importance)
+                self.num_nodes.append(num_nodes)
+                self.depths.append(depth)
+                self.out_of_bag.add_tree(tree, in_bag)
+                if tolerance is not None and self.out_of_bag.has_converged(tolerance, window):
+                    break
+        finally:
+            # Stops the worker processes if we stopped early
+            results.close()
+        return self.num_trees() - num_trees_before
+
+
+# The tree builder of a worker process and the shared training set it works on
+_worker = None
+
+
+def _init_worker(training_descriptor, class_index, attribute_values, limits):
+    global _worker
+    training = sharedarray.SharedArray.attach(training_descriptor)
+    _worker = TreeBuilder(training.array, class_index, attribute_values, **limits), training
+
+
+def _build_tree_in_worker(task):
+    tree_builder, training = _worker
+    return tree_builder.build_bootstrap_tree(*task)
+
+
+# Translate attribute indices and encoded values into human readable columns and values
+def pretty_tree(tree, header, values, class_index):
+    if not isinstance(tree, dict):
+        return values[class_index][tree]
     else:
         pretty_subtrees = {}
         for attribute_value, subtree in tree['subtrees'].items():
-            pretty_subtrees[attribute_value] = pretty_tree(subtree)
+            pretty_subtrees[values[tree['attribute_index']][attribute_value]] = pretty_tree(subtree, header, values,
+                                                                                          class_index)
         return { 'attribute_index' : header[tree['attribute_index']], 'subtrees' : pretty_subtrees}
 
 
-# Estimate importance of a feature by calculating the average information gain
-def get_feature_importance(tree, feature_importance):
-    if not isinstance(tree, str):
-        if header[tree['attribute_index']] in feature_importance:
-            feature_importance[header[tree['attribute_index']]].append(tree['information_gain'])
-        else:
-            feature_importance[header[tree['attribute_index']]] = [tree['information_gain']]
-        for subtree in tree['subtrees'].values():
-            get_feature_importance(subtree, feature_importance)
-
-
-# Feature importance of a forest is calculated by averaging the feature importances of the individual trees
-def get_feature_importance_for_forest(trees):
-    feature_importance = {}
-    for tree in trees:
-        get_feature_importance(tree, feature_importance)
-
-    # Average the information gains
-    for feature_name, importance in feature_importance.items():
-        feature_importance[feature_name] = float(sum(importance)) / len(importance)
-
-    # Finally sort feature importance in descending order
-    return sorted(feature_importance.items(), key=operator.itemgetter(1), reverse=True)
-
-
-# Use a single tree to test our ID3 algorithm.
-# We pass sys.maxsize so no random feature sampling is used.
-the_tree = build_tree(training, feature_indices, sys.maxsize)
-#print(pretty_tree(the_tree))
-
-num_classified_correctly = sum([classify(example, the_tree) ==
-                                example[class_index] for example in test])
-print('Single tree: Accuracy on test dataset: {:.2f}%'.format(float(100 * num_classified_correctly) / num_test_rows))
-
-
-# Perform bootstrap aggregating: Build trees from multiple sample sets
-trees = []
-for i in range(args.num_trees):
-    bootstrap_sample_set = [random.choice(training) for j in range(len(training))]
-    trees.append(build_tree(bootstrap_sample_set, feature_indices, sys.maxsize))
-
-num_classified_correctly = sum([majority_vote(example, trees) ==
-                                example[class_index] for example in test])
-print('Bagging: Accuracy on test dataset: {:.2f}%'.format(float(100 * num_classified_correctly) / num_test_rows))
-
-# Random forest: Additionally select subset of features
-trees = []
-for i in range(args.num_trees):
-    bootstrap_sample_set = [random.choice(training) for j in range(len(training))]
-    trees.append(build_tree(bootstrap_sample_set, feature_indices, args.feature_subset_size))
+# Rank the features by the given importances in descending order. Features that are not split on are left out unless
+# include_unused is set, ties are resolved in favor of the feature that was split on first.
+def rank_features(importances, feature_importance, feature_indices, header, include_unused=False):
+    ranked = sorted([attribute_index for attribute_index in feature_indices
+                     if include_unused or feature_importance.num_splits[attribute_index]],
+                    key=lambda attribute_index: feature_importance.first_split[attribute_index])
+    ranked.sort(key=lambda attribute_index: importances[attribute_index], reverse=True)
+    return [(header[attribute_index], float(importances[attribute_index])) for attribute_index in ranked]
+
+
+# Nothing is printed for a forest without trees, since there is no estimate
+def print_out_of_bag_estimate(name, out_of_bag, print_curve):
+    if not out_of_bag.num_trees():
+        return
+    print(name + ': Out-of-bag accuracy with {} trees: {:.2f}%'.format(out_of_bag.num_trees(),
+                                                                      100 * out_of_bag.accuracy()))
+    if print_curve:
+        for num_trees, accuracy in enumerate(out_of_bag.accuracies):
+            print(name + ': Out-of-bag accuracy with {} trees: {:.2f}%'.format(num_trees + 1, 100 * accuracy))
+
+
+# Evaluate a compiled model on the encoded test dataset chunk by chunk
+def print_evaluation(name, model, test, class_index, class_values, class_metrics):
+    confusion_matrix = evaluation.evaluate(model.predict, test, class_index, len(class_values))
+    print(name + ': Accuracy on test dataset: {:.2f}%'.format(100 * confusion_matrix.accuracy()))
+    if class_metrics:
+        evaluation.print_class_metrics(confusion_matrix, class_values, name + ': ')
+
+
+# Train the single tree, bagging and the random forest on the training rows of a cross-validation fold and return
+# their accuracies on its test rows
+def evaluate_fold(dataset, training_rows, test_rows, class_index, num_classes, feature_indices, attribute_values,
+                  args):
+    tree_builder = TreeBuilder(dataset[training_rows], class_index, attribute_values, max_depth=args.max_depth,
+                               min_samples_split=args.min_samples_split, min_samples_leaf=args.min_samples_leaf,
+                               max_nodes=args.max_nodes)
+    test = dataset[test_rows]
+    trees = {'Single tree': [tree_builder.build_tree(np.arange(len(training_rows)), feature_indices, sys.maxsize)]}
+    for name, feature_subset_size in [('Bagging', sys.maxsize), ('Random forest', args.feature_subset_size)]:
+        forest = Forest(tree_builder, feature_indices, feature_subset_size, args.seed)
+        forest.grow(args.num_trees, 1, args.early_stopping, args.early_stopping_window)
+        trees[name] = forest.trees
+    accuracies = []
+    for name, name_trees in trees.items():
+        model = ForestModel.from_trees(name_trees, tree_builder.num_values, tree_builder.num_classes)
+        accuracies.append((name, evaluation.evaluate(model.predict, test, class_index, num_classes).accuracy()))
+    return accuracies
+
+
+def print_tree_stats(name, num_nodes, depths):
+    for tree_index, (tree_num_nodes, depth) in enumerate(zip(num_nodes, depths)):
+        print(name + ': Tree {}: {} nodes, depth {}'.format(tree_index + 1, tree_num_nodes, depth))
+
+
+def main():
+    args = parser.parse_args()
+
+    # All columns are encoded as small integer codes while reading, values[column_index][code] gives back the value.
+    header, dataset, values = csvloader.load_csv(args.file_name)
+    if args.report_memory:
+        print('Peak memory after loading the dataset: {:.1f} MB'.format(csvloader.peak_memory_mb()))
+    num_rows, num_cols = np.shape(dataset)
+    num_test_rows = int(round(args.test_percentage * num_rows))
+    num_training_rows = num_rows - num_test_rows
+    if args.class_index == 'first':
+        args.class_index = 0
+    elif args.class_index == 'last':
+        args.class_index = num_cols - 1
+    elif args.class_index.is_digit() and not 0 <= int(args.class_index) < num_cols:
+        parser.print_usage()
+        exit('randomforest: error: argument -c/--class_index: Class index is out of bounds.')
+    class_index = args.class_index
+    feature_indices = list(range(class_index)) + list(range(class_index + 1, num_cols))
+    if args.cv is not None:
+        if not 2 <= args.cv <= num_rows:
+            parser.print_usage()
+            exit('randomforest: error: argument -cv/--cv: The number of folds must be between 2 and the number of '
+                 'instances.')
+        # The attribute values are aggregated once, so all folds (and processes) split on them in the same order
+        start = time.perf_counter()
+        folds = crossvalidation.assign_folds(num_rows, args.cv, args.seed)
+        attribute_values = get_attribute_values(dataset, feature_indices, np.arange(num_rows))
+        results = crossvalidation.run_folds(evaluate_fold, dataset, folds, args.cv,
+                                            (class_index, len(values[class_index]), feature_indices, attribute_values,
+                                             args), args.jobs)
+        crossvalidation.print_cross_validation(results, time.perf_counter() - start)
+        if args.report_memory:
+            print('Peak memory: {:.1f} MB'.format(csvloader.peak_memory_mb()))
+        return
+    training_rows, test_rows = csvloader.shuffle_split(num_rows, num_test_rows, args.seed)
+    training = dataset[training_rows]
+    test = dataset[test_rows]
+    print('Number of training instances: ' + str(num_training_rows))
+    print('Number of test instances: ' + str(num_test_rows))
+
+    attribute_values = get_attribute_values(dataset, feature_indices, np.arange(num_rows))
+    tree_builder = TreeBuilder(training, class_index, attribute_values, max_depth=args.max_depth,
+                               min_samples_split=args.min_samples_split, min_samples_leaf=args.min_samples_leaf,
+                               max_nodes=args.max_nodes)
+
+    # Use a single tree to test our ID3 algorithm.
+    # We pass sys.maxsize so no random feature sampling is used.
+    the_tree = tree_builder.build_tree(np.arange(num_training_rows), feature_indices, sys.maxsize)
+    #print(pretty_tree(the_tree, header, values, class_index))
+
+    # Compile the trees into flat node tables and classify all test instances at once
+    model = ForestModel.from_trees([the_tree], tree_builder.num_values, tree_builder.num_classes)
+    print_evaluation('Single tree', model, test, class_index, values[class_index], args.class_metrics)
+    if args.tree_stats:
+        print_tree_stats('Single tree', [tree_builder.num_nodes], [tree_builder.depth])
+    if args.save_model:
+        model.save(os.path.join(args.save_model, 'tree'), header, values, class_index, attribute_values)
+
+    # Perform bootstrap aggregating: Build trees from multiple sample sets
+    forest = Forest(tree_builder, feature_indices, sys.maxsize, args.seed)
+    forest.grow(args.num_trees, args.jobs, args.early_stopping, args.early_stopping_window)
+    trees, out_of_bag = forest.trees, forest.out_of_bag
+
+    model = ForestModel.from_trees(trees, tree_builder.num_values, tree_builder.num_classes)
+    print_evaluation('Bagging', model, test, class_index, values[class_index], args.class_metrics)
+    print_out_of_bag_estimate('Bagging', out_of_bag, args.oob_curve)
+    if args.tree_stats:
+        print_tree_stats('Bagging', forest.num_nodes, forest.depths)
+    if args.save_model:
+        model.save(os.path.join(args.save_model, 'bagging'), header, values, class_index, attribute_values)
+
+    # Random forest: Additionally select subset of features
+    forest = Forest(tree_builder, feature_indices, args.feature_subset_size, args.seed)
+    forest.grow(args.num_trees, args.jobs, args.early_stopping, args.early_stopping_window)
+    trees, out_of_bag = forest.trees, forest.out_of_bag
+
+    model = ForestModel.from_trees(trees, tree_builder.num_values, tree_builder.num_classes)
+    print_evaluation('Random forest', model, test, class_index, values[class_index], args.class_metrics)
+    print_out_of_bag_estimate('Random forest', out_of_bag, args.oob_curve)
+    if args.tree_stats:
+        print_tree_stats('Random forest', forest.num_nodes, forest.depths)
+    if args.save_model:
+        model.save(os.path.join(args.save_model, 'forest'), header, values, class_index, attribute_values)
+
+    # Print out feature importances of the random forest
+    if args.feature_importance == 'gain':
+        ranking = rank_features(forest.importance.average_gains(), forest.importance, feature_indices, header)
+    elif args.feature_importance == 'weighted_gain':
+        ranking = rank_features(forest.importance.mean_weighted_gains(), forest.importance, feature_indices, header)
+    else:
+        ranking = rank_features(model.permutation_importance(test, test[:, class_index], feature_indices, args.seed),
+                                forest.importance, feature_indices, header, True)
+    for rank, feature_importance in enumerate(ranking):
+        print(str(rank + 1) + ': ' + str(feature_importance[0]) + ' {:.3}'.format(feature_importance[1]))
+    if args.report_memory:
+        print('Peak memory: {:.1f} MB'.format(csvloader.peak_memory_mb()))
 
-num_classified_correctly = sum([majority_vote(example, trees) ==
-                                example[class_index] for example in test])
-print('Random forest: Accuracy on test dataset: {:.2f}%'.format(float(100 * num_classified_correctly) / num_test_rows))
 
-# Print out feature importances
-for rank, feature_importance in enumerate(get_feature_importance_for_forest(trees)):
-    print(str(rank + 1) + ': ' + str(feature_importance[0]) + ' {:.3}'.format(feature_importance[1]))
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,166 @@
 import xml.etree.ElementTree as ET
+import json
+import os
+import shutil
+import numpy as np
 from cocktail import Cocktail
 
 root = None
 
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(x).count('1') for x in range(256)], dtype=np.int64)
+
+
+# The case base as columns. Every ingredient and every category of categories.xml has an integer id. bits is a packed
+# bit matrix with one row per case and one bit per ingredient that is set if the case contains the ingredient. The
+# rows of the recipes (ingredient, quantity, unit) are stored as flat arrays, the rows of case i are row_offsets[i] to
+# row_offsets[i + 1]. Quantities and units are ids of their distinct strings. Indexing the case base gives Cocktail
+# views of the cases.
+class CaseBase:
+    def __init__(self, ingredient_categories):
+        self.ingredient_categories = ingredient_categories
+        self.ingredient_names = list(ingredient_categories)
+        self.ingredient_ids = {x: i for i, x in enumerate(self.ingredient_names)}
+        self.category_names = sorted(set(ingredient_categories.values()))
+        category_ids = {x: i for i, x in enumerate(self.category_names)}
+        self.ingredient_category_ids = np.array([category_ids[ingredient_categories[x]]
+                                                 for x in self.ingredient_names], dtype=np.int64)
+        self.titles = np.zeros(0, dtype=str)
+        self.success = np.zeros(0, dtype=bool)
+        self.bits = np.zeros((0, (len(self.ingredient_names) + 7) // 8), dtype=np.uint8)
+        self.row_offsets = np.zeros(1, dtype=np.int64)
+        self.row_ingredients = np.zeros(0, dtype=np.int32)
+        self.row_quantities = np.zeros(0, dtype=np.int32)
+        self.row_units = np.zeros(0, dtype=np.int32)
+        self.quantity_values, self.quantity_ids = [], {}
+        self.unit_values, self.unit_ids = [], {}
+
+    def __len__(self):
+        return self.titles.shape[0]
+
+    def __getitem__(self, case_id):
+        if not -len(self) <= case_id < len(self):
+            raise IndexError('case id out of range')
+        return Cocktail.view(self, case_id % len(self))
+
+    def __iter__(self):
+        for case_id in range(len(self)):
+            yield Cocktail.view(self, case_id)
+
+    def get_value_id(self, value, values, value_ids):
+        if value not in value_ids:
+            value_ids[value] = len(values)
+            values.append(value)
+        return value_ids[value]
+
+    # Add cocktails to the case base. The arrays are extended once for all of them.
+    def extend(self, cocktails):
+        cocktails = list(cocktails)
+        if not cocktails:
+            return
+        rows = [ingredient for cocktail in cocktails for ingredient in cocktail.ingredients]
+        unknown = set([x[0] for x in rows if x[0] not in self.ingredient_ids])
+        if unknown:
+            raise ValueError('The ingredients ' + str(sorted(unknown)) + ' have no category.')
+        row_ingredients = np.array([self.ingredient_ids[x[0]] for x in rows], dtype=np.int32)
+        num_rows = np.array([len(cocktail.ingredients) for cocktail in cocktails], dtype=np.int64)
+        contained = np.zeros((len(cocktails), len(self.ingredient_names)), dtype=bool)
+        contained[np.repeat(np.arange(len(cocktails)), num_rows), row_ingredients] = True
+        self.titles = np.concatenate([self.titles, np.array([cocktail.title for cocktail in cocktails], dtype=str)])
+        self.success = np.concatenate([self.success, [cocktail.success for cocktail in cocktails]]).astype(bool)
+        self.bits = np.concatenate([self.bits, np.packbits(contained, axis=1)])
+        self.row_offsets = np.concatenate([self.row_offsets, self.row_offsets[-1] + np.cumsum(num_rows)])
+        self.row_ingredients = np.concatenate([self.row_ingredients, row_ingredients])
+        self.row_quantities = np.concatenate([self.row_quantities, np.array(
+            [self.get_value_id(x[1], self.quantity_values, self.quantity_ids) for x in rows], dtype=np.int32)])
+        self.row_units = np.concatenate([self.row_units, np.array(
+            [self.get_value_id(x[2], self.unit_values, self.unit_ids) for x in rows], dtype=np.int32)])
+
+    # Save the case base as a directory of .npy files that load can map into memory
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        arrays = {'ingredient_names': np.array(self.ingredient_names, dtype=str), 'titles': self.titles,
+                  'success': self.success, 'bits': self.bits, 'row_offsets': self.row_offsets,
+                  'row_ingredients': self.row_ingredients, 'row_quantities': self.row_quantities,
+                  'row_units': self.row_units, 'quantity_values': np.array(self.quantity_values, dtype=str),
+                  'unit_values': np.array(self.unit_values, dtype=str)}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+    # Load a case base saved with save. The arrays are memory mapped until cases are added. If the ingredients of
+    # categories.xml changed since the case base was saved, the ingredient ids are translated.
+    @classmethod
+    def load(cls, path, ingredient_categories):
+        case_base = cls(ingredient_categories)
+        arrays = {}
+        for name in ['ingredient_names', 'titles', 'success', 'bits', 'row_offsets', 'row_ingredients',
+                     'row_quantities', 'row_units', 'quantity_values', 'unit_values']:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        case_base.titles, case_base.success = arrays['titles'], arrays['success']
+        case_base.row_offsets, case_base.row_ingredients = arrays['row_offsets'], arrays['row_ingredients']
+        case_base.row_quantities, case_base.row_units = arrays['row_quantities'], arrays['row_units']
+        for x in arrays['quantity_values']:
+            case_base.get_value_id(str(x), case_base.quantity_values, case_base.quantity_ids)
+        for x in arrays['unit_values']:
+            case_base.get_value_id(str(x), case_base.unit_values, case_base.unit_ids)
+        ingredient_names = [str(x) for x in arrays['ingredient_names']]
+        if ingredient_names == case_base.ingredient_names:
+            case_base.bits = arrays['bits']
+        else:
+            unknown = [x for x in ingredient_names if x not in case_base.ingredient_ids]
+            used = set(ingredient_names[x] for x in np.unique(case_base.row_ingredients))
+            if used.intersection(unknown):
+                raise ValueError('The ingredients ' + str(sorted(used.intersection(unknown))) + ' have no category.')
+            new_ids = np.array([case_base.ingredient_ids.get(x, -1) for x in ingredient_names], dtype=np.int32)
+            case_base.row_ingredients = new_ids[case_base.row_ingredients]
+            contained = np.zeros((len(case_base), len(case_base.ingredient_names)), dtype=bool)
+            contained[np.repeat(np.arange(len(case_base)), np.diff(case_base.row_offsets)),
+                      case_base.row_ingredients] = True
+            case_base.bits = np.packbits(contained, axis=1)
+        return case_base
+
+    # Add a cocktail to the case base and return its view
+    def append(self, cocktail):
+        self.extend([cocktail])
+        return self[len(self) - 1]
+
+    def get_title(self, case_id):
+        return str(self.titles[case_id])
+
+    def get_ingredients(self, case_id):
+        rows = slice(self.row_offsets[case_id], self.row_offsets[case_id + 1])
+        return [(self.ingredient_names[ingredient], self.quantity_values[quantity], self.unit_values[unit])
+                for ingredient, quantity, unit in zip(self.row_ingredients[rows], self.row_quantities[rows],
+                                                      self.row_units[rows])]
+
+    def get_ingredient_set(self, case_id):
+        rows = slice(self.row_offsets[case_id], self.row_offsets[case_id + 1])
+        return set([self.ingredient_names[x] for x in self.row_ingredients[rows]])
+
+    # Packed bit mask of the ingredients with the given ids
+    def get_mask(self, ingredient_ids):
+        mask = np.zeros(len(self.ingredient_names), dtype=bool)
+        mask[list(ingredient_ids)] = True
+        return np.packbits(mask)
+
+    # counts[i, k] is the number of the given ingredients of category k that case i contains
+    def count_contained(self, ingredient_ids):
+        ingredient_ids = np.array(list(ingredient_ids), dtype=np.int64)
+        counts = np.zeros((len(self), len(self.category_names)), dtype=np.int64)
+        for category_id in np.unique(self.ingredient_category_ids[ingredient_ids]):
+            mask = self.get_mask(ingredient_ids[self.ingredient_category_ids[ingredient_ids] == category_id])
+            counts[:, category_id] = POPCOUNT[self.bits & mask].sum(axis=1)
+        return counts
+
+    # counts[i, k] is the number of rows of case i whose ingredient is of category k and not one of the given ones
+    def count_rows_without(self, ingredient_ids):
+        excluded = np.zeros(len(self.ingredient_names), dtype=bool)
+        excluded[list(ingredient_ids)] = True
+        rows = ~excluded[self.row_ingredients]
+        cases = np.repeat(np.arange(len(self)), np.diff(self.row_offsets))[rows]
+        return np.bincount(cases * len(self.category_names) + self.ingredient_category_ids[self.row_ingredients[rows]],
+                           minlength=len(self) * len(self.category_names)).reshape(len(self), -1)
+
 
 def parse_official_case_base():
     global root
@@ -35,7 +193,7 @@ def load_ingredient_categories_and_alcohol_contents():
     return ingredient_categories, alcohol_contents
 
 
-def load_official_case_base():
+def load_official_case_base(ingredient_categories):
     parse_official_case_base()
     # Extract all cocktails
     cocktails = []
@@ -46,7 +204,9 @@ def load_official_case_base():
                                 ingredient.attrib['quantity'],
                                 ingredient.attrib['unit']))
         cocktails.append(Cocktail(recipe.find('title').text, ingredients, True))
-    return cocktails
+    case_base = CaseBase(ingredient_categories)
+    case_base.extend(cocktails)
+    return case_base
 
 
 def save_case_base(cocktails):
@@ -61,7 +221,7 @@ def save_case_base(cocktails):
     ET.ElementTree(root).write('../Data/case_base.xml')
 
 
-def load_case_base():
+def load_case_base(ingredient_categories):
     cocktails = []
     root = ET.parse('../Data/case_base.xml').getroot()
     for cocktail_element in root:
@@ -70,4 +230,120 @@ def load_case_base():
             ingredients.append((ingredient_element.attrib['food'], ingredient_element.attrib['quantity'],
                                 ingredient_element.attrib['unit']))
         cocktails.append(Cocktail(cocktail_element.attrib['title'], ingredients, True))
-    return cocktails
\ No newline at end of file
+    case_base = CaseBase(ingredient_categories)
+    case_base.extend(cocktails)
+    return case_base
+
+
+# Append-only log of the cases that were added to the case base since its snapshot, one JSON record per line. Each
+# record has the id of the case, so records that are already part of the snapshot are skipped.
+class CaseLog:
+    def __init__(self, path):
+        self.path = path
+
+    # Cases of the log with an id of at least first_case_id as (case id, cocktail) pairs and the size in bytes of the
+    # complete records. An incomplete last line (e.g. after a crash while writing) is ignored.
+    def read(self, first_case_id=0):
+        if not os.path.isfile(self.path):
+            return [], 0
+        cases, size = [], 0
+        with open(self.path, 'rb') as log:
+            for line in log:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete record')
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                size += len(line)
+                if record['case_id'] >= first_case_id:
+                    cases.append((record['case_id'], Cocktail(record['title'], [tuple(x) for x in
+                                                                                record['ingredients']],
+                                                              record['success'])))
+        return cases, size
+
+    # Cut off an incomplete last record, so the next records are appended after the complete ones
+    def truncate(self, size):
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > size:
+            with open(self.path, 'r+b') as log:
+                log.truncate(size)
+                log.flush()
+                os.fsync(log.fileno())
+
+    def append(self, first_case_id, cocktails):
+        with open(self.path, 'a', encoding='utf-8') as log:
+            for case_id, cocktail in enumerate(cocktails, first_case_id):
+                log.write(json.dumps({'case_id': case_id, 'title': cocktail.title,
+                                      'ingredients': [list(x) for x in cocktail.ingredients],
+                                      'success': cocktail.success}) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+# Persistent case base: A binary snapshot (see CaseBase.save) and a log of the cases added since then. Only cases that
+# are not persisted yet are written, by appending them to the log. Once the log holds compaction_threshold cases the
+# snapshot is rewritten and the log is cleared.
+class CaseBaseStorage:
+    def __init__(self, snapshot_path='../Data/case_base', log_path='../Data/case_base.log', compaction_threshold=100):
+        self.snapshot_path = snapshot_path
+        self.log = CaseLog(log_path)
+        self.compaction_threshold = compaction_threshold
+        self.num_saved_cases = 0
+        self.num_logged_cases = 0
+
+    # A crash between the two renames of compact leaves only the old snapshot. Together with the log, which is cleared
+    # after the renames, it still contains every case, so it is moved back into place.
+    def recover(self):
+        old_path = self.snapshot_path + '.old'
+        if not os.path.isdir(self.snapshot_path) and os.path.isdir(old_path):
+            os.rename(old_path, self.snapshot_path)
+
+    def exists(self):
+        self.recover()
+        return os.path.isdir(self.snapshot_path)
+
+    def load(self, ingredient_categories):
+        self.recover()
+        case_base = CaseBase.load(self.snapshot_path, ingredient_categories)
+        cases, size = self.log.read(len(case_base))
+        self.log.truncate(size)
+        # Only a gapless sequence of cases after the snapshot can be added
+        cocktails = []
+        for case_id, cocktail in cases:
+            if case_id != len(case_base) + len(cocktails):
+                break
+            cocktails.append(cocktail)
+        case_base.extend(cocktails)
+        self.num_logged_cases = len(cocktails)
+        self.num_saved_cases = len(case_base)
+        return case_base
+
+    # Persist the cases that were added since the last call, a session without new cases writes nothing
+    def save(self, case_base):
+        if len(case_base) == self.num_saved_cases:
+            return
+        self.log.append(self.num_saved_cases, [case_base[case_id] for case_id in range(self.num_saved_cases,
+                                                                                        len(case_base))])
+        self.num_logged_cases += len(case_base) - self.num_saved_cases
+        self.num_saved_cases = len(case_base)
+        if self.num_logged_cases >= self.compaction_threshold:
+            self.compact(case_base)
+
+    # Rewrite the snapshot with all cases and clear the log. The new snapshot replaces the old one only once it is
+    # complete, the records of the log are skipped when they are already part of the snapshot.
+    def compact(self, case_base):
+        new_path, old_path = self.snapshot_path + '.new', self.snapshot_path + '.old'
+        shutil.rmtree(new_path, ignore_errors=True)
+        case_base.save(new_path)
+        if self.exists():
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.rename(self.snapshot_path, old_path)
+        os.rename(new_path, self.snapshot_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.log.clear()
+        self.num_saved_cases = len(case_base)
+        self.num_logged_cases = 0
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+# Inverted index of the case base: For every ingredient and every category the ids (positions in the case base) of
+# the cocktails that contain it. It gives a lower bound of the edit distance of every cocktail to a query without
+# adapting any cocktail:
+# Every missing desired ingredient and every contained undesired ingredient costs at least one edit, and one
+# replacement fixes at most one of each. A missing desired ingredient whose category does not occur in the cocktail
+# at all can neither replace an undesired nor an optional ingredient, so it has to be added, which costs two edits.
+class CaseIndex:
+    def __init__(self, ingredient_categories):
+        self.ingredient_categories = ingredient_categories
+        self.num_cases = 0
+        self.cases_with_ingredient = {}
+        self.cases_with_category = {}
+
+    # Index the cocktails that were added to the case base since the last update
+    def update(self, cocktails):
+        for case_id in range(self.num_cases, len(cocktails)):
+            ingredient_set = cocktails[case_id].get_ingredient_set()
+            for ingredient in ingredient_set:
+                self.cases_with_ingredient.setdefault(ingredient, []).append(case_id)
+            for category in set([self.ingredient_categories[x] for x in ingredient_set]):
+                self.cases_with_category.setdefault(category, []).append(case_id)
+        self.num_cases = len(cocktails)
+
+    def count_cases(self, postings, keys):
+        counts = np.zeros(self.num_cases, dtype=np.int64)
+        for key in keys:
+            # The ids of a posting list are unique, so they can be incremented at once
+            counts[postings.get(key, [])] += 1
+        return counts
+
+    # Lower bound of the edit distance of every indexed cocktail to the query
+    def lower_bounds(self, desired_ingredients, undesired_ingredients):
+        num_missing = len(desired_ingredients) - self.count_cases(self.cases_with_ingredient, desired_ingredients)
+        num_undesired = self.count_cases(self.cases_with_ingredient, undesired_ingredients)
+        num_missing_category = len(desired_ingredients) - self.count_cases(
+            self.cases_with_category, [self.ingredient_categories[x] for x in desired_ingredients])
+        return 2 * num_missing_category + np.maximum(num_missing - num_missing_category, num_undesired)
+
+    # The same lower bound for a single ingredient set
+    def lower_bound(self, ingredient_set, desired_ingredients, undesired_ingredients):
+        missing_desired_ingredients = desired_ingredients - ingredient_set
+        categories = set([self.ingredient_categories[x] for x in ingredient_set])
+        num_missing_category = len([x for x in missing_desired_ingredients
+                                    if self.ingredient_categories[x] not in categories])
+        return 2 * num_missing_category + max(len(missing_desired_ingredients) - num_missing_category,
+                                              len(ingredient_set & undesired_ingredients))
+
+    # Ids of all indexed cocktails ordered by their lower bound, ties are ordered by id
+    def candidates(self, desired_ingredients, undesired_ingredients):
+        lower_bounds = self.lower_bounds(desired_ingredients, undesired_ingredients)
+        return np.argsort(lower_bounds, kind='stable'), lower_bounds
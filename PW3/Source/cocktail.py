@@ -1,30 +1,72 @@
-
 class Cocktail:
+    # A cocktail is either a view of a case of a case base (case_base and case_id are set) or holds its own title and
+    # ingredients. A view is detached from the case base on its first change, so the cases themselves never change.
+    __slots__ = ('case_base', 'case_id', '_title', '_ingredients', '_success')
+
     def __init__(self, title, ingredients, success):
-        self.title = title
+        self.case_base, self.case_id = None, None
+        self._title = title
 
         # List of tuples: (food, quantity, unit)
-        self.ingredients = ingredients
-        self.success = success  # currently unused, but could be useful for "Learning from failure"
+        self._ingredients = ingredients
+        self._success = success  # currently unused, but could be useful for "Learning from failure"
+
+    @classmethod
+    def view(cls, case_base, case_id):
+        cocktail = cls.__new__(cls)
+        cocktail.case_base, cocktail.case_id = case_base, case_id
+        cocktail._title = cocktail._ingredients = cocktail._success = None
+        return cocktail
+
+    def detach(self):
+        if self.case_base is not None:
+            self._title, self._ingredients, self._success = self.title, self.ingredients, self.success
+            self.case_base, self.case_id = None, None
+
+    # Independent copy that can be adapted
+    def copy(self):
+        return Cocktail(self.title, list(self.ingredients), self.success)
+
+    @property
+    def title(self):
+        return self._title if self.case_base is None else self.case_base.get_title(self.case_id)
+
+    @title.setter
+    def title(self, title):
+        self.detach()
+        self._title = title
+
+    @property
+    def ingredients(self):
+        return self._ingredients if self.case_base is None else self.case_base.get_ingredients(self.case_id)
+
+    @property
+    def success(self):
+        return self._success if self.case_base is None else bool(self.case_base.success[self.case_id])
 
     def replace_ingredient(self, old, new):
-        for i, ingredient in enumerate(self.ingredients):
+        self.detach()
+        for i, ingredient in enumerate(self._ingredients):
             if ingredient[0] == old:
                 break
-        rest = self.ingredients[i][len(new):]
-        self.ingredients[i] = new + rest if type(rest) is tuple else (rest, )
-        self.title += ' with ' + self.ingredients[i][0] + ' instead of ' + old
+        rest = self._ingredients[i][len(new):]
+        self._ingredients[i] = new + rest if type(rest) is tuple else (rest, )
+        self._title += ' with ' + self._ingredients[i][0] + ' instead of ' + old
 
     def add_ingredient(self, new):
-        self.ingredients.append(new)
-        self.title += ' and a bit of ' + new[0]
+        self.detach()
+        self._ingredients.append(new)
+        self._title += ' and a bit of ' + new[0]
 
     def remove_ingredient(self, ingredient):
-        self.ingredients = [x for x in self.ingredients if x[0] != ingredient]
-        self.title += ' without ' + ingredient
+        self.detach()
+        self._ingredients = [x for x in self._ingredients if x[0] != ingredient]
+        self._title += ' without ' + ingredient
 
     def get_ingredient_set(self):
-        return set([x[0] for x in self.ingredients])
+        if self.case_base is not None:
+            return self.case_base.get_ingredient_set(self.case_id)
+        return set([x[0] for x in self._ingredients])
 
     def get_ingredient_quantity(self, ingredient):
         return [x[1] for x in self.ingredients if x[0] == ingredient][0]
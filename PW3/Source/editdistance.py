@@ -0,0 +1,45 @@
+from collections import Counter
+import numpy as np
+
+
+# Edit distance of a cocktail to a query without adapting it. The adaptation works category by category:
+# 1. Each missing desired ingredient replaces a contained undesired ingredient of the same category (one edit) as long
+#    as there are both, i.e. min(missing, undesired) times per category.
+# 2. The remaining missing desired ingredients replace optional ingredients of the same category (one edit). Every row
+#    of the recipe whose ingredient is not desired can be replaced once, except that the first row of each undesired
+#    ingredient was already replaced in step 1.
+# 3. The remaining undesired ingredients are replaced by random ingredients of the same category (one edit).
+# 4. The remaining missing desired ingredients are added (two edits).
+# The result does not depend on the order in which the adaptation picks the ingredients, so no random choice or copy
+# of the cocktail is needed.
+class EditDistanceScorer:
+    def __init__(self, ingredient_categories):
+        self.ingredient_categories = ingredient_categories
+
+    # Edit distance for a list of ingredients (one entry per row of the recipe)
+    def edit_distance(self, ingredients, desired_ingredients, undesired_ingredients):
+        ingredient_set = set(ingredients)
+        contained_undesired_ingredients = ingredient_set & undesired_ingredients
+        missing = Counter([self.ingredient_categories[x] for x in desired_ingredients - ingredient_set])
+        undesired = Counter([self.ingredient_categories[x] for x in contained_undesired_ingredients])
+        replaceable = Counter([self.ingredient_categories[x] for x in ingredients if x not in desired_ingredients])
+        replaceable.subtract([self.ingredient_categories[x] for x in contained_undesired_ingredients
+                              if x not in desired_ingredients])
+        edit_distance = len(contained_undesired_ingredients)
+        for category, num_missing in missing.items():
+            num_replaced_undesired = min(num_missing, undesired[category])
+            num_replaced_optional = min(num_missing - num_replaced_undesired, replaceable[category])
+            edit_distance += 2 * num_missing - 2 * num_replaced_undesired - num_replaced_optional
+        return edit_distance
+
+    # Edit distances of all cases of a case base at once, the same steps as above with one column per category
+    def edit_distances(self, case_base, desired_ingredients, undesired_ingredients):
+        desired = set([case_base.ingredient_ids[x] for x in desired_ingredients])
+        undesired = set([case_base.ingredient_ids[x] for x in undesired_ingredients])
+        missing = np.bincount(case_base.ingredient_category_ids[list(desired)],
+                              minlength=len(case_base.category_names)) - case_base.count_contained(desired)
+        contained_undesired = case_base.count_contained(undesired)
+        replaceable = case_base.count_rows_without(desired) - case_base.count_contained(undesired - desired)
+        replaced_undesired = np.minimum(missing, contained_undesired)
+        replaced_optional = np.minimum(missing - replaced_undesired, replaceable)
+        return (contained_undesired + 2 * missing - 2 * replaced_undesired - replaced_optional).sum(axis=1)
@@ -1,26 +1,65 @@
+import argparse
 import copy
 import random
+import numpy as np
 import os.path
 import sys
 import casebase
+import caseindex
+import editdistance
+import querycache
 
+parser = argparse.ArgumentParser('main')
+parser.add_argument('-ix', '--import_xml',
+                    help='If set the case base is replaced by the cocktails of ../Data/case_base.xml.',
+                    action='store_true')
+parser.add_argument('-ex', '--export_xml',
+                    help='If set the case base is written to ../Data/case_base.xml and the application terminates.',
+                    action='store_true')
 
-def get_similarity_to_query(cocktail, desired_ingredients, undesired_ingredients, ingredient_categories, alcohol_contents):
+
+def get_similarity_to_query(cocktail, desired_ingredients, undesired_ingredients, scorer):
     if not cocktail.success:
         return -sys.maxsize - 1
-    # We use dry runs of the adapt_solution method to calculate an edit distance.
-    return -adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredient_categories,
-                           alcohol_contents, True)[1]
+    # The similarity is the negative number of edits that adapt_solution would make.
+    return -scorer.edit_distance([x[0] for x in cocktail.ingredients], desired_ingredients, undesired_ingredients)
 
 
-def find_most_similar(cocktails, desired_ingredients, undesired_ingredients, ingredient_categories, alcohol_contents):
+def find_most_similar(cocktails, desired_ingredients, undesired_ingredients, scorer, case_index=None, cache=None):
     max_sim, most_similar = -sys.maxsize - 1, None
-    # Do a full search in the flat case base.
-    for cocktail in cocktails:
-        sim = get_similarity_to_query(cocktail, desired_ingredients, undesired_ingredients, ingredient_categories,
-                                      alcohol_contents)
-        if sim > max_sim:
-            max_sim, most_similar = sim, cocktail
+    if cache is not None:
+        # Repeated queries are answered from the cache, which is kept up to date with the added cases
+        cache.update(cocktails)
+        cached = cache.get(desired_ingredients, undesired_ingredients)
+        if cached is not None:
+            return cached[0], None if cached[1] is None else cocktails[cached[1]]
+        max_sim, most_similar = find_most_similar(cocktails, desired_ingredients, undesired_ingredients, scorer,
+                                                  case_index)
+        cache.put(desired_ingredients, undesired_ingredients, max_sim, most_similar.case_id if most_similar else None)
+        return max_sim, most_similar
+    if case_index is None:
+        # Do a full search in the flat case base, all cocktails are scored at once.
+        sims = np.where(cocktails.success, -scorer.edit_distances(cocktails, desired_ingredients,
+                                                                  undesired_ingredients), max_sim)
+        if len(sims) and sims.max() > max_sim:
+            max_sim, most_similar = int(sims.max()), cocktails[int(np.argmax(sims))]
+        return max_sim, most_similar
+
+    # Visit the cocktails in the order of the lower bound of their edit distance. Once the lower bound exceeds the
+    # edit distance of the best cocktail so far no remaining cocktail can be more similar. Like the full search we
+    # prefer the first cocktail of the case base among equally similar ones.
+    case_index.update(cocktails)
+    case_ids, lower_bounds = case_index.candidates(desired_ingredients, undesired_ingredients)
+    most_similar_id = len(cocktails)
+    for case_id in case_ids:
+        if most_similar and (lower_bounds[case_id] > -max_sim or
+                             (lower_bounds[case_id] == -max_sim and case_id > most_similar_id)):
+            break
+        if not cocktails[case_id].success:
+            continue
+        sim = get_similarity_to_query(cocktails[case_id], desired_ingredients, undesired_ingredients, scorer)
+        if sim > max_sim or (sim == max_sim and case_id < most_similar_id):
+            max_sim, most_similar, most_similar_id = sim, cocktails[case_id], case_id
     return max_sim, most_similar
 
 
@@ -61,19 +100,17 @@ def replace_ingredient_and_adjust_quantity(adapted_cocktail, old, new, ingredien
     adapted_cocktail.replace_ingredient(old, new)
 
 
-def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredient_categories, alcohol_contents, dry_run=False):
+def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredient_categories, alcohol_contents):
     edit_distance = 0
     missing_desired_ingredients, contained_undesired_ingredients = \
         get_missing_desired_ingredients_and_contained_undesired_ingredients(cocktail, desired_ingredients,
                                                                             undesired_ingredients)
-    if not dry_run:
-        print_solution_status(None, missing_desired_ingredients, contained_undesired_ingredients)
+    print_solution_status(None, missing_desired_ingredients, contained_undesired_ingredients)
 
     if missing_desired_ingredients or contained_undesired_ingredients:
-        if not dry_run:
-            print('Adapting cocktail so that it contains all desired ingredients and no undesired ones.')
+        print('Adapting cocktail so that it contains all desired ingredients and no undesired ones.')
 
-        adapted_cocktail = copy.deepcopy(cocktail)
+        adapted_cocktail = cocktail.copy()
 
         # Our general strategy is to replace an ingredient in the original recipe only with an ingredient of the
         # same category. Therefore we extracted the categories of ingredients.
@@ -86,12 +123,11 @@ def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredi
                 for contained_undesired_ingredient in contained_undesired_ingredients:
                     if ingredient_categories[missing_desired_ingredient] ==\
                             ingredient_categories[contained_undesired_ingredient]:
-                        if not dry_run:
-                            print('Since the missing desired ingredient ' + str(missing_desired_ingredient) +
-                                  ' and the contained undesired ingredient ' + str(contained_undesired_ingredient)
-                                  + ' are of the same category ' +
-                                  str(ingredient_categories[missing_desired_ingredient]) + ' we can replace ' +
-                                  str(contained_undesired_ingredient) + ' by ' + str(missing_desired_ingredient))
+                        print('Since the missing desired ingredient ' + str(missing_desired_ingredient) +
+                              ' and the contained undesired ingredient ' + str(contained_undesired_ingredient)
+                              + ' are of the same category ' +
+                              str(ingredient_categories[missing_desired_ingredient]) + ' we can replace ' +
+                              str(contained_undesired_ingredient) + ' by ' + str(missing_desired_ingredient))
                         hit = True
                         break
                 if hit:
@@ -102,9 +138,8 @@ def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredi
                                                        alcohol_contents)
                 missing_desired_ingredients.remove(missing_desired_ingredient)
                 contained_undesired_ingredients.remove(contained_undesired_ingredient)
-                if not dry_run:
-                    print_solution_status(adapted_cocktail, missing_desired_ingredients,
-                                          contained_undesired_ingredients)
+                print_solution_status(adapted_cocktail, missing_desired_ingredients,
+                                      contained_undesired_ingredients)
                 edit_distance += 1
             else:
                 break  # need to use another rule
@@ -122,11 +157,10 @@ def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredi
                     # The second condition determines if optional_ingredient is actually optional.
                     if ingredient_categories[missing_desired_ingredient] == ingredient_categories[optional_ingredient]\
                             and optional_ingredient not in desired_ingredients:
-                        if not dry_run:
-                            print('Since the missing desired ingredient ' + str(missing_desired_ingredient) +
-                                  ' and the optional ingredient ' + str(optional_ingredient)
-                                  + ' are of the same category ' + ' we can replace ' + str(optional_ingredient) +
-                                  ' by ' + str(missing_desired_ingredient))
+                        print('Since the missing desired ingredient ' + str(missing_desired_ingredient) +
+                              ' and the optional ingredient ' + str(optional_ingredient)
+                              + ' are of the same category ' + ' we can replace ' + str(optional_ingredient) +
+                              ' by ' + str(missing_desired_ingredient))
                         hit = True
                         break
                 if hit:
@@ -136,9 +170,8 @@ def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredi
                                                        missing_desired_ingredient, ingredient_categories,
                                                        alcohol_contents)
                 missing_desired_ingredients.remove(missing_desired_ingredient)
-                if not dry_run:
-                    print_solution_status(adapted_cocktail, missing_desired_ingredients,
-                                          contained_undesired_ingredients)
+                print_solution_status(adapted_cocktail, missing_desired_ingredients,
+                                      contained_undesired_ingredients)
                 edit_distance += 1
             else:
                 break  # need to use another rule
@@ -151,15 +184,13 @@ def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredi
             while random_ingredient in undesired_ingredients:
                 random_ingredient = get_random_ingredient_of_same_category(contained_undesired_ingredient,
                                                                            ingredient_categories)
-            if not dry_run:
-                print('We replace the contained undesired ingredient ' + str(contained_undesired_ingredient) +
-                      ' by the random ingredient ' + str(random_ingredient) + ' of the same category ' +
-                      str(ingredient_categories[random_ingredient]))
+            print('We replace the contained undesired ingredient ' + str(contained_undesired_ingredient) +
+                  ' by the random ingredient ' + str(random_ingredient) + ' of the same category ' +
+                  str(ingredient_categories[random_ingredient]))
             replace_ingredient_and_adjust_quantity(adapted_cocktail, contained_undesired_ingredient,
                                                    random_ingredient, ingredient_categories,
                                                    alcohol_contents)
-            if not dry_run:
-                print_solution_status(adapted_cocktail, missing_desired_ingredients, contained_undesired_ingredients)
+            print_solution_status(adapted_cocktail, missing_desired_ingredients, contained_undesired_ingredients)
             edit_distance += 1
 
         # Now comes the most unfavorable strategy: we just add a little bit of the remaining missing desired ingredients
@@ -167,18 +198,15 @@ def adapt_solution(cocktail, desired_ingredients, undesired_ingredients, ingredi
         # the category of an ingredient.
         while missing_desired_ingredients:
             missing_desired_ingredient = missing_desired_ingredients.pop()
-            if not dry_run:
-                print('We add a little bit of the missing desired ingredient ' + str(missing_desired_ingredient))
+            print('We add a little bit of the missing desired ingredient ' + str(missing_desired_ingredient))
             unit = 'cl' if ingredient_categories[missing_desired_ingredient] in ['alcoholic', 'nonalcoholic'] else ''
             adapted_cocktail.add_ingredient((missing_desired_ingredient, '1', unit))
-            if not dry_run:
-                print_solution_status(adapted_cocktail, missing_desired_ingredients, contained_undesired_ingredients)
+            print_solution_status(adapted_cocktail, missing_desired_ingredients, contained_undesired_ingredients)
             edit_distance += 2 # give this more weight because of its very heuristic nature
         return adapted_cocktail, edit_distance
     else:
-        if not dry_run:
-            print('Found cocktail already contains all desired ingredients and no undesired ones, so it can be '
-                  'directly used.')
+        print('Found cocktail already contains all desired ingredients and no undesired ones, so it can be '
+              'directly used.')
         return None, 0
 
 
@@ -259,18 +287,37 @@ def evaluate_solution(adapted_cocktail, desired_ingredients, undesired_ingredien
 
 
 def main():
+    args = parser.parse_args()
+    # The case base assigns ids to the ingredients and categories, so they are loaded first
+    ingredient_categories, alcohol_contents = casebase.load_ingredient_categories_and_alcohol_contents()
+
     # Check if we have already established our own case base (with our own cocktails)
-    if os.path.isfile('../Data/case_base.xml'):
+    storage = casebase.CaseBaseStorage()
+    if storage.exists() and not args.import_xml:
         print('Load our case base.')
-        cocktails = casebase.load_case_base()
+        cocktails = storage.load(ingredient_categories)
     else:
-        # Otherwise load official case base: the case base that is provided by the challenge
-        print('Load official case base.')
-        cocktails = casebase.load_official_case_base()
-        # Extract all ingredients from the official case base
-        casebase.extract_ingredients()
+        if os.path.isfile('../Data/case_base.xml'):
+            print('Load our case base from XML.')
+            cocktails = casebase.load_case_base(ingredient_categories)
+        else:
+            # Otherwise load official case base: the case base that is provided by the challenge
+            print('Load official case base.')
+            cocktails = casebase.load_official_case_base(ingredient_categories)
+            # Extract all ingredients from the official case base
+            casebase.extract_ingredients()
+        # From now on only the cases that are added to the case base are written
+        storage.compact(cocktails)
+
+    if args.export_xml:
+        casebase.save_case_base(cocktails)
+        print('Case base written to ../Data/case_base.xml.')
+        return
 
-    ingredient_categories, alcohol_contents = casebase.load_ingredient_categories_and_alcohol_contents()
+    # The index is updated with the cases that are added to the case base before each search
+    case_index = caseindex.CaseIndex(ingredient_categories)
+    scorer = editdistance.EditDistanceScorer(ingredient_categories)
+    cache = querycache.QueryCache(case_index, scorer)
 
     while True:
         print('Please enter all desired ingredients as a space separated list. Substitute spaces in the ingredient\'s '
@@ -304,8 +351,8 @@ def main():
         print('Searching for a cocktail with constraints')
         print("\tdesired ingredients: " + str(desired_ingredients))
         print("\tundesired ingredients: " + str(undesired_ingredients))
-        cocktail = find_most_similar(cocktails, desired_ingredients, undesired_ingredients, ingredient_categories,
-                                     alcohol_contents)[1]
+        cocktail = find_most_similar(cocktails, desired_ingredients, undesired_ingredients, scorer, case_index,
+                                     cache)[1]
         print()
         print("Most similar cocktail found:")
         print(cocktail)
@@ -316,7 +363,8 @@ def main():
         if adapted_cocktail:
             evaluate_solution(adapted_cocktail, desired_ingredients, undesired_ingredients, ingredient_categories,
                               cocktails)
-        casebase.save_case_base(cocktails)
+        storage.save(cocktails)
+    print(cache)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+
+# LRU cache of retrieval results. The key is the query (desired and undesired ingredients as frozensets), the value
+# the similarity and the id of the most similar case. The edit distance of that case is the number of edits of its
+# adaptation. Cases are only ever added to the case base, so a cached result only changes if a new case is strictly
+# more similar (among equally similar cases the first one is retrieved). For every new case the cached queries are
+# checked with the lower bound of the edit distance of the case first, only if it could be more similar its edit
+# distance is computed.
+class QueryCache:
+    def __init__(self, case_index, scorer, capacity=1024):
+        self.case_index = case_index
+        self.scorer = scorer
+        self.capacity = capacity
+        self.results = OrderedDict()
+        self.num_cases = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.updates = 0
+
+    def get_key(self, desired_ingredients, undesired_ingredients):
+        return frozenset(desired_ingredients), frozenset(undesired_ingredients)
+
+    # Cached (similarity, case id) of a query or None
+    def get(self, desired_ingredients, undesired_ingredients):
+        key = self.get_key(desired_ingredients, undesired_ingredients)
+        if key not in self.results:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.results.move_to_end(key)
+        return self.results[key]
+
+    def put(self, desired_ingredients, undesired_ingredients, similarity, case_id):
+        self.results[self.get_key(desired_ingredients, undesired_ingredients)] = similarity, case_id
+        while len(self.results) > self.capacity:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    # Check the cached results against the cocktails that were added to the case base since the last update
+    def update(self, cocktails):
+        for case_id in range(self.num_cases, len(cocktails) if self.results else self.num_cases):
+            cocktail = cocktails[case_id]
+            if not cocktail.success:
+                continue
+            ingredient_set = cocktail.get_ingredient_set()
+            ingredients = [x[0] for x in cocktail.ingredients]
+            for (desired_ingredients, undesired_ingredients), (similarity, most_similar_id) in self.results.items():
+                if most_similar_id is not None and self.case_index.lower_bound(
+                        ingredient_set, desired_ingredients, undesired_ingredients) >= -similarity:
+                    continue
+                edit_distance = self.scorer.edit_distance(ingredients, desired_ingredients, undesired_ingredients)
+                if most_similar_id is None or edit_distance < -similarity:
+                    self.results[desired_ingredients, undesired_ingredients] = -edit_distance, case_id
+                    self.updates += 1
+        self.num_cases = len(cocktails)
+
+    def __str__(self):
+        return 'Query cache: {} hits, {} misses, {} evictions, {} results updated by new cases'.format(
+            self.hits, self.misses, self.evictions, self.updates)